@@ -0,0 +1,38 @@
+import json
+import os
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+class RunStats:
+    """Appends the stats of every crawl to CRAWL_STATS_PATH, one JSON line per run with its crawl profile."""
+
+    def __init__(self, path, profile, stats):
+        self.path = path
+        self.profile = profile
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('CRAWL_STATS_PATH')
+        if not path:
+            raise NotConfigured('CRAWL_STATS_PATH is not set')
+        extension = cls(path, crawler.settings.get('CRAWL_PROFILE'), crawler.stats)
+        # Connected after the core stats extension, which sets the finish time and elapsed time on the same signal
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_closed(self, spider, reason):
+        stats = self.stats.get_stats()
+        elapsed = stats.get('elapsed_time_seconds') or 0
+        record = {
+            'spider': spider.name,
+            'profile': self.profile,
+            'reason': reason,
+            'items_per_second': stats.get('item_scraped_count', 0) / elapsed if elapsed else None,
+            'stats': stats,
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str, sort_keys=True) + '\n')
@@ -0,0 +1,145 @@
+import json
+import re
+
+from lxml import etree
+
+from autoscout24.items import Autoscout24Item
+
+DEFAULT = 'unknown'
+
+# Where each field is shown on a listing page
+FIELD_XPATHS = {
+    'brand': '//*/h1/div[1]/span[1]/text()',
+    'model': '//*/h1/div[1]/span[2]/text()',
+    'price': '//*/div[3]/div[1]/div/span/text()',
+    'first_registration': '//*/div[3]/div[2]/div[3]/div[4]/text()',
+    'mileage': '//*/div[1]/div[4]/text()',
+    'fuel_type': '//*/div[4]/div[4]/text()',
+    'color': '//*[@id="color-section"]/div/div[2]/dl/dd[1]/text()',
+    'gearbox': '//*[@id="technical-details-section"]/div/div[2]/dl/dd[2]/text()',
+    'power': '//*[@id="technical-details-section"]/div/div[2]/dl/dd[1]/text()',
+    'engine_size': '//*[@id="technical-details-section"]/div/div[2]/dl/dd[3]/text()',
+    'seller': '//*[@id="__next"]/div/div/main/div[3]/div[3]/div[2]/div[6]/div[4]/text()',
+    'location': '//*[@id="__next"]/div/div/main/div[3]/div[2]/a/text()',
+    'body_type': '//*[@id="basic-details-section"]/div/div[2]/dl/dd[1]/text()',
+    'doors': '//*[@id="basic-details-section"]/div/div[2]/dl/dd[5]/text()',
+    'seats': '//*[@id="basic-details-section"]/div/div[2]/dl/dd[4]/text()',
+    'drivetrain': '//*[@id="basic-details-section"]/div/div[2]/dl/dd[3]/text()',
+    'co2_emission': '//*[@id="environment-details-section"]/div/div[2]/dl/dd[2]/text()',
+    'emission_class': '//*[@id="environment-details-section"]/div/div[2]/dl/dd[3]/text()',
+    'condition': '//*[@id="basic-details-section"]/div/div[2]/dl/dd[2]/text()',
+    'upholstery': '//*[@id="color-section"]/div/div[2]/dl/dd[4]/text()',
+    'upholstery_color': '//*[@id="color-section"]/div/div[2]/dl/dd[3]/text()',
+}
+# Compiled once, for the pages without the payload
+COMPILED_XPATHS = {field: etree.XPath(xpath) for field, xpath in FIELD_XPATHS.items()}
+
+# The same fields in the Next.js payload (props.pageProps.listingDetails). Several paths are joined with ', ', unless
+# the field has a format in NEXT_DATA_FORMATS. The paths are not checked against live pages yet, so a field is only
+# read from the payload once it is listed in the NEXT_DATA_FIELDS setting, after
+# `python -m benchmarks.parse_car <captured corpus> --check-payload` showed the payload and the page agree on it.
+NEXT_DATA_PATHS = {
+    'brand': ['vehicle.make'],
+    'model': ['vehicle.model'],
+    'price': ['prices.public.price'],
+    'first_registration': ['vehicle.firstRegistrationDate'],
+    'mileage': ['vehicle.mileageInKm'],
+    'fuel_type': ['vehicle.fuelCategory.formatted'],
+    'color': ['vehicle.bodyColor'],
+    'gearbox': ['vehicle.transmissionType'],
+    'power': ['vehicle.powerInKw', 'vehicle.powerInHp'],
+    'engine_size': ['vehicle.displacementInCCM'],
+    'seller': ['seller.type'],
+    'location': ['location.city', 'location.countryCode'],
+    'body_type': ['vehicle.bodyType'],
+    'doors': ['vehicle.numberOfDoors'],
+    'seats': ['vehicle.numberOfSeats'],
+    'drivetrain': ['vehicle.driveTrain'],
+    # The columns are named after the environment section but hold its second and third entries: co2_emission gets
+    # the combined fuel consumption and emission_class the CO2 emissions, which the cleaning reads from it
+    'co2_emission': ['vehicle.fuelConsumptionCombined.formatted'],
+    'emission_class': ['vehicle.co2emissionInGramPerKmWithFallback.formatted'],
+    'condition': ['vehicle.legalCategories.0'],
+    'upholstery': ['vehicle.upholstery'],
+    'upholstery_color': ['vehicle.upholsteryColor'],
+}
+# The payload holds plain numbers where the page shows formatted text, they are written like on the page so that the
+# item parsers read both the same way: 12345.0 is '€ 12,345.-', not '12345.0'.
+NEXT_DATA_FORMATS = {
+    'price': '€ {:,.0f}.-',
+    'mileage': '{:,.0f} km',
+    'power': '{:.0f} kW ({:.0f} hp)',
+    'engine_size': '{:,.0f} cc',
+}
+NEXT_DATA = re.compile(r'<script id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+
+
+def lookup(data, path):
+    for key in path.split('.'):
+        if isinstance(data, list) and key.isdigit() and int(key) < len(data):
+            data = data[int(key)]
+        elif isinstance(data, dict):
+            data = data.get(key)
+        else:
+            return None
+    return data
+
+
+def plain_text(value):
+    # Whole numbers without their decimals, 5.0 seats are '5'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def next_data_value(details, paths, template=None):
+    values = [lookup(details, path) for path in paths]
+    if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) and str(value).strip()
+               for value in values):
+        return None
+    if template is not None and all(isinstance(value, (int, float)) for value in values):
+        return template.format(*values)
+    return ', '.join(plain_text(value) for value in values)
+
+
+def listing_details(text):
+    # The payload is found in the raw text, so that pages it covers entirely are never parsed as HTML
+    match = NEXT_DATA.search(text)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))['props']['pageProps']['listingDetails']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def first_text(texts, default=DEFAULT):
+    return str(texts[0]).strip() if texts and texts[0] else default
+
+
+def extract_car(response, payload_fields=()):
+    """
+    Item of a listing page. The `payload_fields` are read from its Next.js payload, the other fields, those the
+    payload lacks and every field of a page without payload are read from the page with the compiled XPaths.
+    """
+    car = Autoscout24Item(url=response.url)
+    details = listing_details(response.text) if payload_fields else None
+    for field, xpath in COMPILED_XPATHS.items():
+        value = None
+        if details is not None and field in payload_fields:
+            value = next_data_value(details, NEXT_DATA_PATHS[field], NEXT_DATA_FORMATS.get(field))
+        car[field] = value if value is not None else first_text(xpath(response.selector.root))
+    return car
+
+
+def compare_payload(response):
+    """{field: (payload text, page text)} of the fields the Next.js payload of a listing page has."""
+    details = listing_details(response.text)
+    if details is None:
+        return {}
+    compared = {}
+    for field, xpath in COMPILED_XPATHS.items():
+        value = next_data_value(details, NEXT_DATA_PATHS[field], NEXT_DATA_FORMATS.get(field))
+        if value is not None:
+            compared[field] = (value, first_text(xpath(response.selector.root)))
+    return compared
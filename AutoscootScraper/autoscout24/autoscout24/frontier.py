@@ -0,0 +1,89 @@
+import sqlite3
+import time
+
+# SQLite limits the number of parameters of a single statement
+BATCH_SIZE = 900
+# Pages are leased from the first of these queues that has some: pending listing pages, which add work for the other
+# workers, then pending detail pages, then pages whose lease expired
+QUEUES = [
+    "state = 'pending' AND kind = 'listing'",
+    "state = 'pending' AND kind = 'detail'",
+    "state = 'leased' AND leased_at < :expired",
+]
+
+
+class Frontier:
+    """
+    Pages left to crawl, shared through one SQLite file by the processes of a sharded crawl: the listing pages of the
+    brands (`kind` 'listing') and the detail pages of the listings found on them ('detail'). A worker leases pages,
+    crawls them, adds the pages they link to and marks them done. A lease older than `lease_seconds` goes back to the
+    queue, so that the pages of a worker that stopped are crawled by another one.
+    """
+
+    def __init__(self, path, lease_seconds=600):
+        self.lease_seconds = lease_seconds
+        # Autocommit, leases take the write lock with BEGIN IMMEDIATE. Other workers wait for it up to `timeout`.
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL DEFAULT 'listing',
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                leased_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS pages_queue ON pages (state, kind);
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, urls, kind='listing'):
+        self.connection.executemany('INSERT OR IGNORE INTO pages (url, kind) VALUES (?, ?)',
+                                    ((url, kind) for url in urls))
+
+    def lease(self, worker, n=1):
+        # [(url, kind)] of up to `n` pages, in the order they were added within each queue
+        now = time.time()
+        n = min(n, BATCH_SIZE)
+        if n <= 0:
+            return []
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            pages = []
+            for queue in QUEUES:
+                if len(pages) < n:
+                    pages += self.connection.execute(
+                        f'SELECT url, kind FROM pages WHERE {queue} ORDER BY rowid LIMIT :n',
+                        {'expired': now - self.lease_seconds, 'n': n - len(pages)}).fetchall()
+            self.connection.execute(
+                f"UPDATE pages SET state = 'leased', worker = ?, leased_at = ? "
+                f"WHERE url IN ({','.join('?' * len(pages))})", [worker, now, *(url for url, _ in pages)])
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return pages
+
+    def finish(self, url, state='done'):
+        self.connection.execute('UPDATE pages SET state = ?, finished_at = ? WHERE url = ?', (state, time.time(), url))
+
+    def leased_elsewhere(self, worker):
+        # Pages other workers are still crawling, which may add more pages
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM pages WHERE state = 'leased' AND worker != ? AND leased_at >= ?",
+            (worker, time.time() - self.lease_seconds)).fetchone()[0]
+
+    def counts(self):
+        # {(kind, state): pages}
+        return {(kind, state): n for kind, state, n in
+                self.connection.execute('SELECT kind, state, COUNT(*) FROM pages GROUP BY kind, state')}
@@ -3,10 +3,65 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+import re
+
 import scrapy
 
+NUMBER = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+
+
+def number_parser(strip=None, extract=None, require=None):
+    """
+    Same rules as the cleaning notebook: the text must contain `require`, the number is taken from the first group
+    of `extract`, every match of `strip` is dropped and what is left must be a number, otherwise the value is None.
+    """
+    strip = re.compile(strip) if strip else None
+    extract = re.compile(extract) if extract else None
+
+    def parse(text):
+        if not text or (require and require not in text):
+            return None
+        if extract:
+            match = extract.search(text)
+            if not match:
+                return None
+            text = match.group(1)
+        if strip:
+            text = strip.sub('', text)
+        text = text.strip()
+        return float(text) if NUMBER.fullmatch(text) else None
+
+    return parse
+
 
 class Autoscout24Item(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # Every field holds the text of the listing page, 'unknown' when missing. Fields with a `parser` also get a
+    # typed column, `<field>_value`, in the Parquet output of ParquetPipeline.
+    url = scrapy.Field()
+    brand = scrapy.Field()
+    model = scrapy.Field()
+    # '€ 12,345.-' or '€ 1.234,-', both whole euros
+    price = scrapy.Field(parser=number_parser(r'[€.,\-]'))
+    # '05/2019'
+    first_registration = scrapy.Field(parser=number_parser(extract=r'(\d{4})'))
+    # '45,000 km'
+    mileage = scrapy.Field(parser=number_parser(r' km|[, ]'))
+    fuel_type = scrapy.Field()
+    color = scrapy.Field()
+    gearbox = scrapy.Field()
+    # '110 kW (150 hp)', the horsepower is kept
+    power = scrapy.Field(parser=number_parser(r' hp\)| kW\)|[ ,]', extract=r'^[^(]*\(([^(]*)'))
+    # '1,968 cc'
+    engine_size = scrapy.Field(parser=number_parser(r' cc|,', require='cc'))
+    seller = scrapy.Field()
+    location = scrapy.Field()
+    body_type = scrapy.Field()
+    doors = scrapy.Field()
+    seats = scrapy.Field()
+    drivetrain = scrapy.Field()
+    # '128 g/km (comb.)', the page layout puts it in either field
+    co2_emission = scrapy.Field(parser=number_parser(r'g/km|,|\(comb\.?\)| ', require='g/km'))
+    emission_class = scrapy.Field(parser=number_parser(r'g/km|,|\(comb\.?\)| ', require='g/km'))
+    condition = scrapy.Field()
+    upholstery = scrapy.Field()
+    upholstery_color = scrapy.Field()
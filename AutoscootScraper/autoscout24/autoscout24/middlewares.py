@@ -36,6 +36,12 @@ class Autoscout24SpiderMiddleware:
         for i in result:
             yield i
 
+    async def process_spider_output_async(self, response, result, spider):
+        # Same as process_spider_output() for spiders and middlewares
+        # whose output is asynchronous, which Scrapy 2.13+ requires.
+        async for i in result:
+            yield i
+
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
         # (from other spider middleware) raises an exception.
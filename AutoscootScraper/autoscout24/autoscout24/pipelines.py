@@ -3,11 +3,90 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import time
 
+import pyarrow as pa
+import pyarrow.parquet as pq
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from autoscout24.items import Autoscout24Item
+
+VALUE_SUFFIX = '_value'
+TEXT_FIELDS = list(Autoscout24Item.fields)
+PARSED_FIELDS = [name for name, field in Autoscout24Item.fields.items() if 'parser' in field]
+SCHEMA = pa.schema([(name, pa.string()) for name in TEXT_FIELDS] +
+                   [(name + VALUE_SUFFIX, pa.float64()) for name in PARSED_FIELDS])
 
 
 class Autoscout24Pipeline:
     def process_item(self, item, spider):
         return item
+
+
+class ParquetPipeline:
+    """
+    Writes the items to a directory of Parquet files: the text of every field, as in the CSV feed, and the numbers
+    of the parsed fields as `<field>_value`. Items are buffered and written as one file when PARQUET_BUFFER_SIZE of
+    them are waiting or every PARQUET_FLUSH_SECONDS, so memory stays bounded and a stopped crawl keeps everything
+    but the last buffer.
+    """
+
+    def __init__(self, output, buffer_size=5000, flush_seconds=60, stats=None):
+        self.output = output
+        self.buffer_size = buffer_size
+        self.flush_seconds = flush_seconds
+        self.stats = stats
+        self.columns = {name: [] for name in SCHEMA.names}
+        self.buffered = 0
+        self.files = 0
+        self.run = time.strftime('%Y%m%dT%H%M%S')
+        self.flusher = task.LoopingCall(self.flush)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.get('PARQUET_OUTPUT'):
+            raise NotConfigured('PARQUET_OUTPUT is not set')
+        return cls(settings.get('PARQUET_OUTPUT'), settings.getint('PARQUET_BUFFER_SIZE', 5000),
+                   settings.getfloat('PARQUET_FLUSH_SECONDS', 60), crawler.stats)
+
+    def open_spider(self, spider):
+        os.makedirs(self.output, exist_ok=True)
+        if self.flush_seconds:
+            self.flusher.start(self.flush_seconds, now=False)
+
+    def close_spider(self, spider):
+        if self.flusher.running:
+            self.flusher.stop()
+        self.flush()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        for name in TEXT_FIELDS:
+            self.columns[name].append(adapter.get(name))
+        for name in PARSED_FIELDS:
+            self.columns[name + VALUE_SUFFIX].append(Autoscout24Item.fields[name]['parser'](adapter.get(name)))
+        self.buffered += 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        if not self.buffered:
+            return
+        table = pa.table(self.columns, schema=SCHEMA)
+        # Written under a hidden name and renamed, readers of the directory skip files starting with '.'
+        filename = f'{self.run}-{self.files:05d}.parquet'
+        hidden = os.path.join(self.output, '.' + filename)
+        pq.write_table(table, hidden, compression='zstd')
+        os.replace(hidden, os.path.join(self.output, filename))
+        self.files += 1
+        self.columns = {name: [] for name in SCHEMA.names}
+        self.buffered = 0
+        if self.stats:
+            self.stats.inc_value('parquet/items', table.num_rows)
+            self.stats.inc_value('parquet/files')
@@ -0,0 +1,59 @@
+import sqlite3
+import time
+from urllib.parse import urldefrag
+
+# SQLite limits the number of parameters of a single statement
+BATCH_SIZE = 900
+
+
+def listing_key(url):
+    # Listing pages link the same offer with different tracking parameters
+    return urldefrag(url)[0].split('?')[0]
+
+
+class SeenUrls:
+    """
+    Listing URLs scraped by previous crawls, with the time they were last scraped. A URL older than `max_age`
+    seconds counts as unseen again, so that its listing gets refreshed.
+    """
+
+    def __init__(self, path, max_age=None):
+        self.max_age = max_age
+        # Shared by the workers of a sharded crawl, which wait for each other's writes
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY, scraped_at REAL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def known(self, urls):
+        # The subset of `urls` scraped within max_age
+        urls = list(urls)
+        oldest = time.time() - self.max_age if self.max_age else 0
+        found = set()
+        for start in range(0, len(urls), BATCH_SIZE):
+            batch = urls[start:start + BATCH_SIZE]
+            rows = self.connection.execute(
+                f'SELECT url FROM seen WHERE url IN ({",".join("?" * len(batch))}) AND scraped_at >= ?',
+                [*batch, oldest])
+            found.update(row[0] for row in rows)
+        return found
+
+    def add(self, urls):
+        now = time.time()
+        self.connection.executemany('INSERT OR REPLACE INTO seen (url, scraped_at) VALUES (?, ?)',
+                                    ((url, now) for url in urls))
+        # Committed right away, an open write transaction would block the other workers of a sharded crawl
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
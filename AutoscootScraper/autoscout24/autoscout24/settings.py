@@ -20,6 +20,7 @@ USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTM
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
 
+# Concurrency and delays are set by the crawl profiles at the end of this file
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 #CONCURRENT_REQUESTS = 32
 
@@ -59,36 +60,96 @@ SPIDER_MIDDLEWARES = {
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "autoscout24.extensions.RunStats": 500,
+}
+
+# The stats of every crawl, with its profile, are appended to this JSON lines file. Empty to disable.
+CRAWL_STATS_PATH = "output/crawl_stats.jsonl"
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "autoscout24.pipelines.Autoscout24Pipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "autoscout24.pipelines.ParquetPipeline": 300,
+}
 
-# Enable and configure the AutoThrottle extension (disabled by default)
-# See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-#AUTOTHROTTLE_ENABLED = True
-# The initial download delay
-#AUTOTHROTTLE_START_DELAY = 5
-# The maximum download delay to be set in case of high latencies
-#AUTOTHROTTLE_MAX_DELAY = 60
-# The average number of requests Scrapy should be sending in parallel to
-# each remote server
-#AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
-# Enable showing throttling stats for every response received:
-#AUTOTHROTTLE_DEBUG = False
-
-# Enable and configure HTTP caching (disabled by default)
+# Directory of Parquet files written by ParquetPipeline, empty to disable it. A file is written every
+# PARQUET_BUFFER_SIZE items, and every PARQUET_FLUSH_SECONDS when items are waiting.
+PARQUET_OUTPUT = "output/cars"
+PARQUET_BUFFER_SIZE = 5000
+PARQUET_FLUSH_SECONDS = 60
+
+# Fields of the detail pages read from their Next.js payload rather than with XPaths, e.g. "brand,model,price". The
+# payload paths in autoscout24/extract.py are not checked against the live site yet: list a field only once
+# `python -m benchmarks.parse_car <corpus> --check-payload`, on pages captured from a real crawl, shows the payload and
+# the page agree on it.
+NEXT_DATA_FIELDS = []
+
+# SQLite store of the listings already scraped, their detail pages are not downloaded again and the pagination of a
+# brand stops at the first page without new listings. Empty for a full crawl. Listings scraped more than
+# SEEN_URLS_MAX_AGE_DAYS ago are scraped again, 0 keeps them forever.
+SEEN_URLS_PATH = "output/seen_urls.sqlite"
+SEEN_URLS_MAX_AGE_DAYS = 0
+
+# Sharded crawl: the listing and detail pages are leased from a SQLite frontier shared by several processes, see
+# autoscout24/sharded.py. Each worker crawls up to FRONTIER_LEASE_SIZE pages at a time, and pages leased longer than
+# FRONTIER_LEASE_SECONDS ago go to another worker. SHARD_NAME defaults to <host>-<pid>.
+FRONTIER_PATH = ""
+FRONTIER_LEASE_SIZE = 16
+FRONTIER_LEASE_SECONDS = 600
+SHARD_NAME = ""
+
+# Filesystem HTTP cache of the downloaded pages, see the crawl profiles below
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_GZIP = True
+HTTPCACHE_IGNORE_HTTP_CODES = [403, 404, 429, 500, 502, 503, 504]
+
+# Concurrency, AutoThrottle and HTTP cache settings of each crawl profile, applied on top of this file. Settings
+# given with -s still win. Select one with `scrapy crawl autoscoot -s CRAWL_PROFILE=fast`:
+# - polite: a couple of requests at a time to autoscout24.com, slowed down when its responses slow down
+# - fast: more parallel requests, throttled to the latency of the site
+# - replay: offline, only the responses of earlier crawls from the HTTP cache, to rerun the parser after a change.
+#   Every listing is parsed again and written to output/replay.
+# The live profiles store every response in the cache, which serves them again for HTTPCACHE_EXPIRATION_SECS so
+# that the next nightly crawl downloads fresh listing pages.
+# See https://docs.scrapy.org/en/latest/topics/autothrottle.html
+CRAWL_PROFILE = "polite"
+CRAWL_PROFILES = {
+    "polite": {
+        "CONCURRENT_REQUESTS": 8,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 2,
+        "DOWNLOAD_DELAY": 1,
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 2,
+        "AUTOTHROTTLE_MAX_DELAY": 30,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 1.0,
+        "HTTPCACHE_ENABLED": True,
+        "HTTPCACHE_EXPIRATION_SECS": 20 * 3600,
+    },
+    "fast": {
+        "CONCURRENT_REQUESTS": 32,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 16,
+        "DOWNLOAD_DELAY": 0,
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 0.5,
+        "AUTOTHROTTLE_MAX_DELAY": 10,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 8.0,
+        "HTTPCACHE_ENABLED": True,
+        "HTTPCACHE_EXPIRATION_SECS": 20 * 3600,
+    },
+    "replay": {
+        "CONCURRENT_REQUESTS": 64,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 64,
+        "DOWNLOAD_DELAY": 0,
+        "AUTOTHROTTLE_ENABLED": False,
+        "HTTPCACHE_ENABLED": True,
+        "HTTPCACHE_EXPIRATION_SECS": 0,
+        "HTTPCACHE_IGNORE_MISSING": True,
+        "SEEN_URLS_PATH": "",
+        "PARQUET_OUTPUT": "output/replay",
+    },
+}
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -0,0 +1,121 @@
+# Sharded crawl: several Scrapy processes share the brand listing pages through a SQLite frontier, each one writes
+# its own Parquet partition and the partitions are merged at the end. Run from AutoscootScraper/autoscout24:
+#   python -m autoscout24.sharded crawl --workers 4
+#   python -m autoscout24.sharded crawl --workers 4 --base-url http://127.0.0.1:8765 --brands audi bmw
+# On several machines sharing a directory with working file locks, seed the frontier once, start one worker per
+# machine and merge their partitions at the end:
+#   python -m autoscout24.sharded seed /shared/frontier.sqlite
+#   scrapy crawl autoscoot -s FRONTIER_PATH=/shared/frontier.sqlite -s PARQUET_OUTPUT=/shared/shards/$(hostname)
+#   python -m autoscout24.sharded merge /shared/shards output/cars
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from autoscout24.frontier import Frontier
+from autoscout24.pipelines import SCHEMA
+from autoscout24.spiders.cars_spider import BASE_URL, BRANDS, brand_url
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(path, brands=BRANDS, base_url=BASE_URL):
+    with Frontier(path) as frontier:
+        frontier.add(brand_url(brand, 1, base_url) for brand in brands)
+        return frontier.counts()
+
+
+def merge(shard_root, output):
+    """
+    Writes the items of every shard partition under `shard_root` to one Parquet file in the `output` directory,
+    keeping the first of the items crawled by several workers. Returns the path and the number of items.
+    """
+    os.makedirs(output, exist_ok=True)
+    filename = f'{time.strftime("%Y%m%dT%H%M%S")}-merged.parquet'
+    hidden = os.path.join(output, '.' + filename)
+    urls = set()
+    rows = 0
+    with pq.ParquetWriter(hidden, SCHEMA, compression='zstd') as writer:
+        for batch in ds.dataset(shard_root, format='parquet', schema=SCHEMA).to_batches():
+            keep = []
+            for url in batch.column('url').to_pylist():
+                keep.append(url not in urls)
+                urls.add(url)
+            table = pa.Table.from_batches([batch]).filter(pa.array(keep))
+            writer.write_table(table)
+            rows += table.num_rows
+    os.replace(hidden, os.path.join(output, filename))
+    return os.path.join(output, filename), rows
+
+
+def crawl(workers, output_dir, merged_output, brands=BRANDS, base_url=BASE_URL, settings=(), resume=False):
+    frontier_path = os.path.join(output_dir, 'frontier.sqlite')
+    shard_root = os.path.join(output_dir, 'shards')
+    if not resume:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(shard_root, exist_ok=True)
+    seed(frontier_path, brands, base_url)
+
+    started = time.perf_counter()
+    processes = []
+    for i in range(workers):
+        name = f'shard-{i}'
+        command = [sys.executable, '-m', 'scrapy', 'crawl', 'autoscoot',
+                   '-s', f'FRONTIER_PATH={os.path.abspath(frontier_path)}', '-s', f'SHARD_NAME={name}',
+                   '-s', f'PARQUET_OUTPUT={os.path.abspath(os.path.join(shard_root, name))}',
+                   '-s', f'LOG_FILE={os.path.abspath(os.path.join(output_dir, name + ".log"))}']
+        for setting in settings:
+            command += ['-s', setting]
+        processes.append(subprocess.Popen(command, cwd=PROJECT_DIR))
+    failed = [i for i, process in enumerate(processes) if process.wait() != 0]
+    seconds = time.perf_counter() - started
+
+    with Frontier(frontier_path) as frontier:
+        counts = frontier.counts()
+    print(f'{workers} workers in {seconds:.1f}s, pages: {counts}')
+    if failed:
+        print(f'Workers {failed} failed, see their logs in {output_dir}. Rerun with --resume to finish the crawl.')
+    path, rows = merge(shard_root, merged_output)
+    print(f'Merged {rows} listings into {path}')
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl autoscout24 with several Scrapy processes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    crawl_parser = subparsers.add_parser('crawl', help='seed the frontier, run the workers and merge their output')
+    crawl_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    crawl_parser.add_argument('--output-dir', default='output/sharded',
+                              help='frontier, shard partitions and logs of the crawl')
+    crawl_parser.add_argument('--merged-output', default='output/cars')
+    crawl_parser.add_argument('--resume', action='store_true', help='continue the crawl left in --output-dir')
+    seed_parser = subparsers.add_parser('seed', help='add the first listing page of every brand to a frontier')
+    seed_parser.add_argument('frontier')
+    for subparser in (crawl_parser, seed_parser):
+        subparser.add_argument('--brands', nargs='+', default=BRANDS)
+        subparser.add_argument('--base-url', default=BASE_URL)
+    crawl_parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                              help='Scrapy setting passed to every worker')
+    merge_parser = subparsers.add_parser('merge', help='merge the shard partitions into one Parquet file')
+    merge_parser.add_argument('shard_root')
+    merge_parser.add_argument('output')
+    args = parser.parse_args()
+
+    if args.command == 'crawl':
+        sys.exit(crawl(args.workers, args.output_dir, args.merged_output, args.brands, args.base_url, args.set,
+                       args.resume))
+    elif args.command == 'seed':
+        print(seed(args.frontier, args.brands, args.base_url))
+    else:
+        path, rows = merge(args.shard_root, args.output)
+        print(f'Merged {rows} listings into {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,185 @@
+import os
+import socket
+
 import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from urllib.parse import urljoin
 
+from autoscout24.extract import extract_car
+from autoscout24.frontier import Frontier
+from autoscout24.seen import SeenUrls, listing_key
+
+BASE_URL = 'https://www.autoscout24.com'
+BRANDS = [
+    'audi', 'bmw', 'ford', 'opel', 'volkswagen', 'renault', 'alfa-romeo', 'aston-martin', 'bentley', 'bugatti',
+    'cadillac', 'chevrolet', 'citroen', 'corvette', 'cupra', 'dacia', 'ferrari', 'honda', 'hyundai', 'jaguar',
+    'jeep', 'kia', 'land-rover', 'lamborghini', 'lexus', 'maserati', 'mazda', 'mclaren', 'mini', 'mitsubishi',
+    'nissan', 'peugeot', 'porsche', 'rolls-royce', 'skoda', 'seat', 'smart', 'subaru', 'suzuki', 'tesla', 'toyota'
+]
+
+
+def brand_url(brand, page=1, base_url=BASE_URL):
+    return f'{base_url}/lst/{brand}?atype=C&sort=age&desc=1&page={page}'
+
+
 class AutoScootSpider(scrapy.Spider):
     name = "autoscoot"
-    start_urls = [
-        f'https://www.autoscout24.com/lst/{brand}?atype=C&desc=1&page=1' for brand in [
-            'audi', 'bmw', 'ford', 'opel', 'volkswagen', 'renault', 'alfa-romeo', 'aston-martin', 'bentley', 'bugatti',
-            'cadillac', 'chevrolet', 'citroen', 'corvette', 'cupra', 'dacia', 'ferrari', 'honda', 'hyundai', 'jaguar',
-            'jeep', 'kia', 'land-rover', 'lamborghini', 'lexus', 'maserati', 'mazda', 'mclaren', 'mini', 'mitsubishi',
-            'nissan', 'peugeot', 'porsche', 'rolls-royce', 'skoda', 'seat', 'smart', 'subaru', 'suzuki', 'tesla', 'toyota'
-        ]
-    ]
+    start_urls = [brand_url(brand) for brand in BRANDS]
 
     n_pages_to_scrape = 20
+    # Listings scraped by earlier crawls, see SEEN_URLS_PATH
+    seen = None
+    # Pages shared with the other workers of a sharded crawl, see FRONTIER_PATH
+    frontier = None
+    # Frontier pages this worker is crawling
+    in_flight = 0
+    # Fields read from the Next.js payload of the detail pages, see NEXT_DATA_FIELDS
+    payload_fields = ()
+
+    def __init__(self, *args, brands=None, base_url=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # `-a brands=audi,bmw -a base_url=http://127.0.0.1:8000` crawls some of the brands, or a mock of the site
+        if brands or base_url:
+            self.start_urls = [brand_url(brand, 1, base_url or BASE_URL)
+                               for brand in (brands.split(',') if brands else BRANDS)]
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # The crawl profile overrides the project settings, settings given on the command line override it
+        profiles = settings.getdict('CRAWL_PROFILES')
+        profile = settings.get('CRAWL_PROFILE')
+        if profile not in profiles:
+            raise ValueError(f'Unknown CRAWL_PROFILE {profile!r}, expected one of {", ".join(profiles)}')
+        settings.setdict(profiles[profile], priority='spider')
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        path = crawler.settings.get('SEEN_URLS_PATH')
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            max_age = crawler.settings.getfloat('SEEN_URLS_MAX_AGE_DAYS') * 24 * 3600
+            spider.seen = SeenUrls(path, max_age or None)
+            crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        spider.payload_fields = frozenset(crawler.settings.getlist('NEXT_DATA_FIELDS'))
+        path = crawler.settings.get('FRONTIER_PATH')
+        if path:
+            spider.frontier = Frontier(path, crawler.settings.getfloat('FRONTIER_LEASE_SECONDS'))
+            spider.worker = crawler.settings.get('SHARD_NAME') or f'{socket.gethostname()}-{os.getpid()}'
+            spider.lease_size = crawler.settings.getint('FRONTIER_LEASE_SIZE')
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    async def start(self):
+        # Scrapy 2.13+ calls start() instead of start_requests(), which is kept for the older versions
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        if not self.frontier:
+            for url in self.start_urls:
+                yield scrapy.Request(url, dont_filter=True)
+            return
+        self.crawler.stats.set_value('frontier/worker', self.worker)
+        yield from self.leased_requests(self.lease_size)
+
+    def leased_requests(self, n):
+        # Pages of the shared frontier, the pages they link to go back to it for any worker
+        for url, kind in self.frontier.lease(self.worker, n):
+            self.in_flight += 1
+            self.crawler.stats.inc_value(f'frontier/leased/{kind}')
+            if kind == 'listing':
+                yield scrapy.Request(url, callback=self.parse, errback=self.page_failed, dont_filter=True,
+                                     meta={'frontier_url': url})
+            else:
+                yield scrapy.Request(url, callback=self.parse_car, errback=self.page_failed, dont_filter=True,
+                                     meta={'frontier_url': url, 'listing_key': listing_key(url)})
+
+    def page_failed(self, failure):
+        self.crawler.stats.inc_value('frontier/failed')
+        yield from self.finish_page(failure.request, 'failed')
+
+    def spider_idle(self, spider):
+        # Keeps the worker running while other workers crawl pages, the pages they add may come up
+        requests = list(self.leased_requests(self.lease_size - self.in_flight))
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests or self.frontier.leased_elsewhere(self.worker):
+            raise DontCloseSpider
 
     def parse(self, response):
-        # Process each car on the current page
+        yield from self.frontier_page(response, self.parse_listing_page)
+
+    def parse_listing_page(self, response):
+        listings = {}
         for car in response.css('div.ListItem_wrapper__TxHWu'):
             relative_url = car.css('a::attr(href)').get()
             if relative_url:
                 full_url = urljoin(response.url, relative_url)
-                yield response.follow(full_url, callback=self.parse_car)
+                listings.setdefault(listing_key(full_url), full_url)
+
+        # Process each car on the current page that no earlier crawl scraped
+        known = self.seen.known(listings) if self.seen else set()
+        self.crawler.stats.inc_value('seen/known_listings', len(known))
+        new = {key: full_url for key, full_url in listings.items() if key not in known}
+        next_page_url = self.next_page_url(response.url, listings, known)
+        if self.frontier:
+            self.frontier.add(new.values(), 'detail')
+            if next_page_url:
+                self.frontier.add([next_page_url])
+            return
+        for key, full_url in new.items():
+            yield response.follow(full_url, callback=self.parse_car, meta={'listing_key': key})
+        if next_page_url:
+            yield response.follow(next_page_url, callback=self.parse)
+
+    def next_page_url(self, url, listings, known):
+        # The newest listings come first, once a whole page is known the next ones are known too
+        if listings and len(known) == len(listings):
+            self.crawler.stats.inc_value('seen/stopped_pagination')
+            return None
 
         # Follow pagination link
-        current_page_number = int(response.url.split('page=')[1].split('&')[0])
+        current_page_number = int(url.split('page=')[1].split('&')[0])
         next_page_number = current_page_number + 1
         if next_page_number <= self.n_pages_to_scrape: 
-            next_page_url = response.url.replace(f'page={current_page_number}', f'page={next_page_number}')
-            yield response.follow(next_page_url, callback=self.parse)
+            return url.replace(f'page={current_page_number}', f'page={next_page_number}')
+        return None
+
+    def frontier_page(self, response, callback):
+        # A page leased from the frontier is finished once its callback is done, as failed when the callback raised,
+        # so that it is not left leased and the worker keeps FRONTIER_LEASE_SIZE pages in flight
+        if 'frontier_url' not in response.meta:
+            yield from callback(response)
+            return
+        try:
+            yield from callback(response)
+        except Exception:
+            self.crawler.stats.inc_value('frontier/failed')
+            yield from self.finish_page(response, 'failed')
+            raise
+        yield from self.finish_page(response)
+
+    def finish_page(self, response, state='done'):
+        # The worker leases new pages to crawl FRONTIER_LEASE_SIZE of them at a time. Requests that were not leased
+        # from the frontier have nothing to finish.
+        url = response.meta.get('frontier_url')
+        if url is None:
+            return
+        self.frontier.finish(url, state)
+        self.in_flight -= 1
+        yield from self.leased_requests(self.lease_size - self.in_flight)
+
+    def item_scraped(self, item, response, spider):
+        self.seen.add([response.meta.get('listing_key') or listing_key(item['url'])])
+
+    def closed(self, reason):
+        if self.seen:
+            self.seen.close()
+        if self.frontier:
+            self.frontier.close()
 
     def parse_car(self, response):
-        def extract_with_default(xpath, default="unknown"):
-            return response.xpath(xpath).get().strip() if response.xpath(xpath).get() else default
-
-        car_info = {
-            'url': response.url,
-            'brand': extract_with_default('//*/h1/div[1]/span[1]/text()'),
-            'model': extract_with_default('//*/h1/div[1]/span[2]/text()'),
-            'price': extract_with_default('//*/div[3]/div[1]/div/span/text()'),
-            'first_registration': extract_with_default('//*/div[3]/div[2]/div[3]/div[4]/text()'),
-            'mileage': extract_with_default('//*/div[1]/div[4]/text()'),
-            'fuel_type': extract_with_default('//*/div[4]/div[4]/text()'),
-            'color': extract_with_default('//*[@id="color-section"]/div/div[2]/dl/dd[1]/text()'),
-            'gearbox': extract_with_default('//*[@id="technical-details-section"]/div/div[2]/dl/dd[2]/text()'),
-            'power': extract_with_default('//*[@id="technical-details-section"]/div/div[2]/dl/dd[1]/text()'),
-            'engine_size': extract_with_default('//*[@id="technical-details-section"]/div/div[2]/dl/dd[3]/text()'),
-            'seller': extract_with_default('//*[@id="__next"]/div/div/main/div[3]/div[3]/div[2]/div[6]/div[4]/text()'),
-            'location': extract_with_default('//*[@id="__next"]/div/div/main/div[3]/div[2]/a/text()'),
-            'body_type': extract_with_default('//*[@id="basic-details-section"]/div/div[2]/dl/dd[1]/text()'),
-            'doors': extract_with_default('//*[@id="basic-details-section"]/div/div[2]/dl/dd[5]/text()'),
-            'seats': extract_with_default('//*[@id="basic-details-section"]/div/div[2]/dl/dd[4]/text()'),
-            'drivetrain': extract_with_default('//*[@id="basic-details-section"]/div/div[2]/dl/dd[3]/text()'),
-            'co2_emission': extract_with_default('//*[@id="environment-details-section"]/div/div[2]/dl/dd[2]/text()'),
-            'emission_class': extract_with_default('//*[@id="environment-details-section"]/div/div[2]/dl/dd[3]/text()'),
-            'condition': extract_with_default('//*[@id="basic-details-section"]/div/div[2]/dl/dd[2]/text()'),
-            'upholstery': extract_with_default('//*[@id="color-section"]/div/div[2]/dl/dd[4]/text()'),
-            'upholstery_color': extract_with_default('//*[@id="color-section"]/div/div[2]/dl/dd[3]/text()'),
-        }
-
-        yield car_info
+        yield from self.frontier_page(response, lambda response: [extract_car(response, self.payload_fields)])
@@ -0,0 +1,151 @@
+# Writes a corpus of synthetic autoscout24 pages laid out like the live site, for the parser benchmark and offline
+# crawls. Run from AutoscootScraper/autoscout24:
+#   python -m benchmarks.fixtures fixtures --brands audi bmw --pages 3 --listings 20
+# Listing pages are written to lst/<brand>/<page>.html and detail pages to offers/<id>.html. Every
+# --html-only-every-th detail page has no Next.js payload, so that the XPath fallback is measured too. The payload
+# follows the paths autoscout24/extract.py reads, it tests the formatting of its values but not the paths.
+import argparse
+import html
+import json
+import os
+import random
+
+FUEL_TYPES = ['Gasoline', 'Diesel', 'Electric', 'Electric/Gasoline', 'LPG']
+COLORS = ['Black', 'White', 'Grey', 'Silver', 'Blue', 'Red']
+GEARBOXES = ['Automatic', 'Manual', 'Semi-automatic']
+BODY_TYPES = ['Sedan', 'Station wagon', 'Compact', 'Off-Road/Pick-up', 'Coupe', 'Convertible']
+DRIVETRAINS = ['Front', 'Rear', '4WD']
+SELLERS = ['Dealer', 'Private seller']
+CITIES = [('Berlin', 'DE'), ('Milano', 'IT'), ('Lyon', 'FR'), ('Antwerpen', 'BE'), ('Wien', 'AT'), ('Madrid', 'ES')]
+UPHOLSTERIES = ['Cloth', 'Full leather', 'Part leather', 'Alcantara']
+MODELS = ['a1', 'a3', 'a4', 'a6', 'q3', 'q5', 'x1', 'x3', 'golf', 'polo', 'focus', 'corsa']
+
+
+def random_car(rng, brand):
+    # The numbers the payload holds, the page shows them formatted
+    numbers = {'price': rng.randint(2_000, 120_000), 'mileage': rng.randint(0, 300_000), 'kw': rng.randint(50, 300),
+               'cc': rng.randint(900, 5000)}
+    numbers['hp'] = round(numbers['kw'] * 1.36)
+    return {
+        'numbers': numbers,
+        'brand': brand.replace('-', ' ').title(),
+        'model': rng.choice(MODELS).upper(),
+        'price': f'€ {numbers["price"]:,}.-',
+        'first_registration': f'{rng.randint(1, 12):02d}/{rng.randint(2005, 2024)}',
+        'mileage': f'{numbers["mileage"]:,} km',
+        'fuel_type': rng.choice(FUEL_TYPES),
+        'color': rng.choice(COLORS),
+        'gearbox': rng.choice(GEARBOXES),
+        'power': f'{numbers["kw"]} kW ({numbers["hp"]} hp)',
+        'engine_size': f'{numbers["cc"]:,} cc',
+        'seller': rng.choice(SELLERS),
+        'city': rng.choice(CITIES),
+        'body_type': rng.choice(BODY_TYPES),
+        'doors': str(rng.choice([2, 3, 4, 5])),
+        'seats': str(rng.choice([2, 4, 5, 7])),
+        'drivetrain': rng.choice(DRIVETRAINS),
+        'co2_emission': f'{rng.uniform(3, 12):.1f} l/100 km (comb.)',
+        'emission_class': f'{rng.randint(0, 300)} g/km (comb.)',
+        'condition': rng.choice(['Used', 'Used', 'New']),
+        'upholstery': rng.choice(UPHOLSTERIES),
+        'upholstery_color': rng.choice(COLORS),
+    }
+
+
+def next_data(car, filler_kb):
+    # Like the live payload, numbers are not formatted and the price is a float
+    numbers = car['numbers']
+    vehicle = {
+        'make': car['brand'], 'model': car['model'], 'firstRegistrationDate': car['first_registration'],
+        'mileageInKm': numbers['mileage'], 'fuelCategory': {'formatted': car['fuel_type']}, 'bodyColor': car['color'],
+        'transmissionType': car['gearbox'], 'powerInKw': numbers['kw'], 'powerInHp': numbers['hp'],
+        'displacementInCCM': numbers['cc'],
+        'bodyType': car['body_type'], 'numberOfDoors': int(car['doors']), 'numberOfSeats': int(car['seats']),
+        'driveTrain': car['drivetrain'], 'fuelConsumptionCombined': {'formatted': car['co2_emission']},
+        'co2emissionInGramPerKmWithFallback': {'formatted': car['emission_class']},
+        'legalCategories': [car['condition']], 'upholstery': car['upholstery'],
+        'upholsteryColor': car['upholstery_color'],
+    }
+    details = {'vehicle': vehicle, 'prices': {'public': {'price': float(numbers['price'])}},
+               'location': {'city': car['city'][0], 'countryCode': car['city'][1]}, 'seller': {'type': car['seller']}}
+    # The live payload also carries translations and tracking data, which make most of its size
+    translations = {f'key{i}': 'x' * 40 for i in range(filler_kb * 1024 // 50)}
+    return json.dumps({'props': {'pageProps': {'listingDetails': details, 'translations': translations}},
+                       'page': '/offers/[slug]'})
+
+
+def section(section_id, values):
+    entries = ''.join(f'<dt>label</dt><dd>{html.escape(value)}</dd>' for value in values)
+    return f'<div id="{section_id}"><div><div><h2>{section_id}</h2></div><div><dl>{entries}</dl></div></div></div>'
+
+
+def filler(kb):
+    # Navigation and footer links, without the nested divs the generic XPaths would match
+    links = ''.join(f'<li><a href="/lst/brand-{i}">Brand {i}</a></li>' for i in range(kb * 1024 // 50))
+    return f'<ul class="nav">{links}</ul>'
+
+
+def detail_page(car, payload, filler_kb):
+    grid = ''.join(f'<div><div>icon</div><div>label</div><div></div><div>{html.escape(value)}</div></div>'
+                   for value in [car['mileage'], car['gearbox'], car['first_registration'], car['fuel_type'],
+                                 car['power'], car['seller']])
+    script = f'<script id="__NEXT_DATA__" type="application/json">{payload}</script>' if payload else ''
+    return f'''<!DOCTYPE html><html><head><title>{car['brand']} {car['model']}</title></head><body>
+<header>{filler(filler_kb // 2)}</header>
+<div id="__next"><div><div><main><div><a href="/">Back</a></div><div><p>Gallery</p></div>
+<div><div><div><span>{car['price']}</span></div></div><div><a href="#map">{car['city'][0]}, {car['city'][1]}</a></div>
+<div><h1><div><span>{car['brand']}</span><span>{car['model']}</span></div></h1><div><p>Top offer</p></div>
+<div>{grid}</div></div></div>
+{section('basic-details-section', [car['body_type'], car['condition'], car['drivetrain'], car['seats'], car['doors']])}
+{section('technical-details-section', [car['power'], car['gearbox'], car['engine_size']])}
+{section('environment-details-section', ['Euro 6', car['co2_emission'], car['emission_class']])}
+{section('color-section', [car['color'], 'Metallic', car['upholstery_color'], car['upholstery']])}
+</main></div></div></div>
+<footer>{filler(filler_kb // 2)}</footer>{script}</body></html>'''
+
+
+def listing_page(offer_ids):
+    items = ''.join(f'<div class="ListItem_wrapper__TxHWu"><a href="/offers/{offer_id}?source=list">'
+                    f'{offer_id}</a></div>' for offer_id in offer_ids)
+    return f'<!DOCTYPE html><html><body><main>{items}</main></body></html>'
+
+
+def write_corpus(directory, brands, n_pages, n_listings, html_only_every=4, filler_kb=150, seed=0):
+    """Writes the pages and returns the number of detail pages."""
+    rng = random.Random(seed)
+    n = 0
+    for brand in brands:
+        os.makedirs(os.path.join(directory, 'lst', brand), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'offers'), exist_ok=True)
+        for page in range(1, n_pages + 1):
+            offer_ids = []
+            for _ in range(n_listings):
+                n += 1
+                offer_id = f'{brand}-{n:06d}'
+                car = random_car(rng, brand)
+                payload = None if html_only_every and n % html_only_every == 0 else next_data(car, filler_kb // 3)
+                with open(os.path.join(directory, 'offers', f'{offer_id}.html'), 'w') as f:
+                    f.write(detail_page(car, payload, filler_kb))
+                offer_ids.append(offer_id)
+            with open(os.path.join(directory, 'lst', brand, f'{page}.html'), 'w') as f:
+                f.write(listing_page(offer_ids))
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic autoscout24 listing and detail pages')
+    parser.add_argument('directory')
+    parser.add_argument('--brands', nargs='+', default=['audi', 'bmw', 'volkswagen'])
+    parser.add_argument('--pages', type=int, default=2, help='listing pages per brand')
+    parser.add_argument('--listings', type=int, default=20, help='listings per page')
+    parser.add_argument('--html-only-every', type=int, default=4)
+    parser.add_argument('--filler-kb', type=int, default=150, help='markup around the listing, per detail page')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    n = write_corpus(args.directory, args.brands, args.pages, args.listings, args.html_only_every, args.filler_kb,
+                     args.seed)
+    print(f'Wrote {n} detail pages to {args.directory}')
+
+
+if __name__ == '__main__':
+    main()
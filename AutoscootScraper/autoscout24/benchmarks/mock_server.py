@@ -0,0 +1,69 @@
+# Serves a corpus written by benchmarks/fixtures.py the way autoscout24.com serves its pages, for offline crawls:
+#   python -m benchmarks.mock_server fixtures --port 8765 --latency 0.1
+#   scrapy crawl autoscoot -a base_url=http://127.0.0.1:8765 -a brands=audi,bmw,volkswagen
+# /lst/<brand>?...&page=<n> answers lst/<brand>/<n>.html and /offers/<id> answers offers/<id>.html.
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def corpus_path(directory, path):
+    parts = urlsplit(path)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if len(segments) != 2 or segments[0] not in ('lst', 'offers') or segments[1] in ('.', '..'):
+        return None
+    if segments[0] == 'lst':
+        page = parse_qs(parts.query).get('page', ['1'])[0]
+        return os.path.join(directory, 'lst', segments[1], f'{int(page) if page.isdigit() else 0}.html')
+    return os.path.join(directory, 'offers', f'{segments[1]}.html')
+
+
+def handler(directory, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            path = corpus_path(directory, self.path)
+            if path is None or not os.path.exists(path):
+                self.send_error(404)
+                return
+            with open(path, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(directory, port=0, latency=0):
+    """Starts the server in a background thread and returns it, `server.server_address` holds its port."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler(directory, latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a corpus of saved autoscout24 pages')
+    parser.add_argument('corpus', nargs='?', default='fixtures')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='seconds to wait before every response')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler(args.corpus, args.latency))
+    print(f'Serving {args.corpus} on http://127.0.0.1:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Measures pages per second of the detail page parser on one core, on a corpus of saved pages. Run from
+# AutoscootScraper/autoscout24:
+#   python -m benchmarks.fixtures fixtures
+#   python -m benchmarks.parse_car fixtures
+# The former parse_car, which evaluated every XPath twice, is measured too and all must give the same items.
+# The fixtures build their payload from the paths extract.py reads, so only pages of a real crawl tell whether these
+# paths are right. Capture some and compare what the payload and the page show for every field:
+#   python -m benchmarks.replay capture .scrapy/httpcache/autoscoot captured
+#   python -m benchmarks.parse_car captured --check-payload
+import argparse
+import glob
+import os
+import time
+from collections import Counter
+
+from scrapy.http import HtmlResponse
+
+from autoscout24.extract import DEFAULT, FIELD_XPATHS, NEXT_DATA_PATHS, compare_payload, extract_car, listing_details
+
+
+def xpath_twice(response):
+    # parse_car before the payload and the compiled XPaths
+    def extract_with_default(xpath, default=DEFAULT):
+        return response.xpath(xpath).get().strip() if response.xpath(xpath).get() else default
+
+    return {'url': response.url, **{field: extract_with_default(xpath) for field, xpath in FIELD_XPATHS.items()}}
+
+
+PARSERS = {
+    'xpath twice': xpath_twice,
+    'xpaths': extract_car,
+    'payload': lambda response: extract_car(response, NEXT_DATA_PATHS),
+}
+
+
+def load_pages(directory):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, 'offers', '*.html'))):
+        with open(path, 'rb') as f:
+            body = f.read()
+        url = f'https://www.autoscout24.com/offers/{os.path.basename(path)[:-len(".html")]}'
+        pages.append((url, body))
+    return pages
+
+
+def pages_per_second(parse, pages, repeats):
+    # A new response for every run, responses cache their decoded text and parsed tree
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.process_time()
+        for url, body in pages:
+            parse(HtmlResponse(url=url, body=body, encoding='utf-8'))
+        best = min(best, time.process_time() - started)
+    return len(pages) / best
+
+
+def check_payload(pages):
+    # Pages where the payload and the page agree on each field, and the first disagreement
+    agree, disagree, examples = Counter(), Counter(), {}
+    for url, body in pages:
+        for field, (payload, page) in compare_payload(HtmlResponse(url=url, body=body, encoding='utf-8')).items():
+            if payload == page:
+                agree[field] += 1
+            else:
+                disagree[field] += 1
+                examples.setdefault(field, (url, payload, page))
+    print(f'{"field":>20} {"agree":>6} {"differ":>6}')
+    for field in FIELD_XPATHS:
+        print(f'{field:>20} {agree[field]:>6} {disagree[field]:>6}')
+    for field, (url, payload, page) in examples.items():
+        print(f'{field}: {payload!r} in the payload, {page!r} on {url}')
+    verified = [field for field in FIELD_XPATHS if agree[field] and not disagree[field]]
+    print(f'NEXT_DATA_FIELDS={",".join(verified)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the detail page parser on saved pages')
+    parser.add_argument('corpus', nargs='?', default='fixtures', help='directory holding offers/*.html')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--check-payload', action='store_true',
+                        help='compare the payload and the page field by field instead of measuring the parsers')
+    args = parser.parse_args()
+
+    pages = load_pages(args.corpus)
+    if not pages:
+        parser.error(f'no pages in {args.corpus}/offers, write some with python -m benchmarks.fixtures')
+    if args.check_payload:
+        check_payload(pages)
+        return
+    with_payload, without_payload = [], []
+    for url, body in pages:
+        has_payload = listing_details(body.decode('utf-8')) is not None
+        (with_payload if has_payload else without_payload).append((url, body))
+
+    mismatches = 0
+    for url, body in pages:
+        expected = xpath_twice(HtmlResponse(url=url, body=body, encoding='utf-8'))
+        for name, parse in list(PARSERS.items())[1:]:
+            if dict(parse(HtmlResponse(url=url, body=body, encoding='utf-8'))) != expected:
+                mismatches += 1
+                print(f'Different items from {name} for {url}')
+
+    size = sum(len(body) for _, body in pages) / len(pages)
+    print(f'{len(pages)} pages of {size / 1e3:.0f} kB on average, {len(with_payload)} with a Next.js payload')
+    print(f'{"parser":>14} {"pages":>16} {"pages/s":>9}')
+    for name, parse in PARSERS.items():
+        for label, subset in [('all', pages), ('with payload', with_payload), ('without payload', without_payload)]:
+            if subset:
+                print(f'{name:>14} {label:>16} {pages_per_second(parse, subset, args.repeats):>9.0f}')
+    if mismatches:
+        raise SystemExit(f'{mismatches} pages parsed differently')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+# Crawls a corpus of saved pages end to end with the spider, served by benchmarks/mock_server.py, and reports
+# items/s, CPU per item, peak memory and how often every field was extracted. Run from AutoscootScraper/autoscout24:
+#   python -m benchmarks.fixtures fixtures --brands audi bmw ford --pages 4
+#   python -m benchmarks.replay run fixtures --save replay-baseline
+#   python -m benchmarks.replay run fixtures --baseline replay-baseline
+# With --baseline the run fails when it scrapes other items or values, extracts a field less often, or its items/s
+# drop by more than --tolerance. Pages of a live crawl are captured from its HTTP cache:
+#   python -m benchmarks.replay capture .scrapy/httpcache/autoscoot captured
+import argparse
+import collections
+import glob
+import gzip
+import json
+import os
+import pickle
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from autoscout24.extract import DEFAULT
+from autoscout24.pipelines import PARSED_FIELDS, SCHEMA, TEXT_FIELDS, VALUE_SUFFIX
+from benchmarks.mock_server import corpus_path, serve
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The crawl is bound by the spider rather than by politeness, nothing is read from or written to the stores of
+# earlier crawls
+SETTINGS = {
+    'CRAWL_PROFILE': 'fast',
+    'DOWNLOAD_DELAY': '0',
+    'AUTOTHROTTLE_ENABLED': 'False',
+    'HTTPCACHE_ENABLED': 'False',
+    'SEEN_URLS_PATH': '',
+    'FRONTIER_PATH': '',
+}
+
+
+def read_cache_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    # HTTPCACHE_GZIP compresses every file of the cache
+    return gzip.decompress(data) if data[:2] == b'\x1f\x8b' else data
+
+
+def capture(cache_dir, corpus):
+    """Copies the listing and detail pages of Scrapy's filesystem HTTP cache into a corpus. Returns the pages copied."""
+    n = 0
+    for meta_path in glob.glob(os.path.join(cache_dir, '*', '*', 'pickled_meta')):
+        meta = pickle.loads(read_cache_file(meta_path))
+        parts = urlsplit(meta['url'])
+        path = corpus_path(corpus, f'{parts.path}?{parts.query}')
+        if meta['status'] != 200 or path is None:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(read_cache_file(os.path.join(os.path.dirname(meta_path), 'response_body')))
+        n += 1
+    return n
+
+
+def extraction_rates(table):
+    # {field: share of the items where it was extracted}, the text fields and the numbers parsed from them
+    rates = {}
+    for name in TEXT_FIELDS:
+        values = table.column(name).to_pylist()
+        rates[name] = sum(value not in (None, '', DEFAULT) for value in values) / len(values) if values else 0
+    for name in PARSED_FIELDS:
+        column = table.column(name + VALUE_SUFFIX)
+        rates[name + VALUE_SUFFIX] = 1 - column.null_count / len(column) if len(column) else 0
+    return rates
+
+
+def crawl(corpus, work_dir, settings=()):
+    """Runs `scrapy crawl autoscoot` against the served corpus and returns the report of the run and its items."""
+    brands = sorted(os.listdir(os.path.join(corpus, 'lst')))
+    server = serve(corpus)
+    stats_path = os.path.join(work_dir, 'crawl_stats.jsonl')
+    items_dir = os.path.join(work_dir, 'items')
+    command = [sys.executable, '-m', 'scrapy', 'crawl', 'autoscoot',
+               '-a', f'base_url=http://127.0.0.1:{server.server_address[1]}', '-a', f'brands={",".join(brands)}',
+               '-s', f'PARQUET_OUTPUT={items_dir}', '-s', f'CRAWL_STATS_PATH={stats_path}',
+               '-s', f'LOG_FILE={os.path.join(work_dir, "crawl.log")}']
+    for setting in [f'{name}={value}' for name, value in SETTINGS.items()] + list(settings):
+        command += ['-s', setting]
+    # The server runs in this process, the CPU time and memory of the crawl are those of its own process
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    try:
+        subprocess.run(command, cwd=PROJECT_DIR, check=True)
+    finally:
+        server.shutdown()
+    seconds = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    with open(stats_path) as f:
+        record = json.loads(f.readlines()[-1])
+    items = ds.dataset(items_dir, format='parquet', schema=SCHEMA).to_table() \
+        if os.path.isdir(items_dir) else SCHEMA.empty_table()
+    cpu = after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+    report = {
+        'detail_pages': len(glob.glob(os.path.join(corpus, 'offers', '*.html'))),
+        'items': items.num_rows,
+        'seconds': seconds,
+        # From the engine start, without the start-up of the process
+        'items_per_second': record['items_per_second'],
+        'cpu_ms_per_item': 1e3 * cpu / items.num_rows if items.num_rows else None,
+        # Linux reports kilobytes
+        'peak_rss_mb': after.ru_maxrss / 1024,
+        'finish_reason': record['reason'],
+        'extraction_rates': extraction_rates(items),
+    }
+    return report, items
+
+
+def compare(report, items, baseline_report, baseline_items, tolerance):
+    """Returns the differences from the baseline run that fail the gate."""
+    failures = []
+    if report['items'] != baseline_report['items']:
+        failures.append(f'{report["items"]} items against {baseline_report["items"]}')
+    for name, rate in baseline_report['extraction_rates'].items():
+        if report['extraction_rates'].get(name, 0) < rate:
+            failures.append(f'{name} extracted in {report["extraction_rates"].get(name, 0):.1%} of the items '
+                            f'against {rate:.1%}')
+    minimum = baseline_report['items_per_second'] * (1 - tolerance)
+    if report['items_per_second'] < minimum:
+        failures.append(f'{report["items_per_second"]:.1f} items/s against {baseline_report["items_per_second"]:.1f}')
+
+    expected = {row['url']: row for row in baseline_items.to_pylist()}
+    changed = {}
+    for row in items.to_pylist():
+        previous = expected.get(row['url'])
+        for name in ([] if previous is None else row):
+            if row[name] != previous.get(name):
+                changed[name] = changed.get(name, 0) + 1
+    failures += [f'{name} differs in {n} items' for name, n in sorted(changed.items())]
+    return failures
+
+
+def print_report(report):
+    print(f'{report["items"]} items of {report["detail_pages"]} detail pages in {report["seconds"]:.1f}s '
+          f'({report["finish_reason"]})')
+    print(f'{report["items_per_second"]:.1f} items/s, {report["cpu_ms_per_item"] or 0:.1f} ms CPU per item, '
+          f'{report["peak_rss_mb"]:.0f} MB peak RSS')
+    print('Extracted in:')
+    for name, rate in report['extraction_rates'].items():
+        print(f'{name:>28} {rate:>7.1%}')
+
+
+def log_tail(path, n_lines=30):
+    try:
+        with open(path, errors='replace') as f:
+            return ''.join(collections.deque(f, n_lines))
+    except FileNotFoundError:
+        return f'{path} was not written\n'
+
+
+def run(corpus, baseline=None, save=None, tolerance=0.2, settings=()):
+    # The work directory of a failed crawl is kept, with its log
+    work_dir = tempfile.mkdtemp(prefix='replay-')
+    try:
+        report, items = crawl(os.path.abspath(corpus), work_dir, settings)
+    except subprocess.CalledProcessError as e:
+        log_path = os.path.join(work_dir, 'crawl.log')
+        print(f'The crawl exited with status {e.returncode}, end of {log_path}:')
+        print(log_tail(log_path), end='')
+        return 1
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print_report(report)
+    if save:
+        os.makedirs(save, exist_ok=True)
+        with open(os.path.join(save, 'report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        pq.write_table(items, os.path.join(save, 'items.parquet'))
+        print(f'Saved the run as a baseline in {save}')
+    if baseline:
+        with open(os.path.join(baseline, 'report.json')) as f:
+            baseline_report = json.load(f)
+        failures = compare(report, items, baseline_report, pq.read_table(os.path.join(baseline, 'items.parquet')),
+                           tolerance)
+        for failure in failures:
+            print(f'FAIL {failure}')
+        if failures:
+            return 1
+        print(f'Same items as {baseline}, {report["items_per_second"] / baseline_report["items_per_second"]:.2f}x '
+              f'its items/s')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay saved autoscout24 pages through the spider')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='crawl a corpus and report throughput and extraction')
+    run_parser.add_argument('corpus', nargs='?', default='fixtures', help='directory holding lst/ and offers/')
+    run_parser.add_argument('--save', help='directory to save the report and items of the run to, as a baseline')
+    run_parser.add_argument('--baseline', help='directory of a saved run, fail on any regression from it')
+    run_parser.add_argument('--tolerance', type=float, default=0.2, help='items/s drop allowed against the baseline')
+    run_parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                            help='Scrapy setting passed to the crawl')
+    capture_parser = subparsers.add_parser('capture', help='copy the pages of an HTTP cache into a corpus')
+    capture_parser.add_argument('cache_dir', help='cache directory of the spider, e.g. .scrapy/httpcache/autoscoot')
+    capture_parser.add_argument('corpus')
+    args = parser.parse_args()
+
+    if args.command == 'capture':
+        print(f'Copied {capture(args.cache_dir, args.corpus)} pages to {args.corpus}')
+    else:
+        sys.exit(run(args.corpus, args.baseline, args.save, args.tolerance, args.set))
+
+
+if __name__ == '__main__':
+    main()
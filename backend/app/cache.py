@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def cache_key(indices, values):
+    # Keyed on the encoded features rather than the raw dict, so key order, unknown fields, None values and
+    # 4 vs 4.0 do not create separate entries for inputs the model cannot tell apart
+    order = np.argsort(indices, kind='stable')
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.asarray(indices, dtype=np.int32)[order].tobytes())
+    digest.update(np.asarray(values, dtype=np.float32)[order].tobytes())
+    return digest.digest()
+
+
+class PredictionCache:
+    """Bounded LRU cache of predictions whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_size=4096, ttl=3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # Bumped by every clear, a prediction started before a model reload must not be cached after it
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+class FileWatcher:
+    """Tells when any of the watched files was replaced or modified, checking the disk at most every `interval`."""
+
+    def __init__(self, paths, interval=1.0):
+        self.paths = list(paths)
+        self.interval = interval
+        self._fingerprint = self.fingerprint()
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def fingerprint(self):
+        fingerprint = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                fingerprint.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                fingerprint.append(None)
+        return fingerprint
+
+    def changed(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.interval:
+                return False
+            self._checked_at = now
+        return self.fingerprint() != self._fingerprint
+
+    def refresh(self, fingerprint):
+        # Called with the fingerprint taken before the files were reloaded successfully, a failed reload is
+        # retried on the next check
+        self._fingerprint = fingerprint
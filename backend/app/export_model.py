@@ -0,0 +1,47 @@
+# Exports a pickled model and feature list to XGBoost's native format and a JSON feature schema, run from the
+# backend directory:
+#   python -m app.export_model app/xgbr_price_predictor.pkl app/feature_names.pkl --output-dir app
+import argparse
+import json
+import os
+import pickle
+from app.features import FeatureTransformer
+
+NATIVE_MODEL_NAME = 'xgbr_price_predictor.ubj'
+FEATURE_SCHEMA_NAME = 'feature_schema.json'
+
+
+def export_native(model, transformer, output_dir):
+    # model is an XGBRegressor or a Booster, the .ubj file loads with any XGBoost version without scikit-learn.
+    # transformer is the fitted FeatureTransformer, or the list of training feature names
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    if not isinstance(transformer, FeatureTransformer):
+        transformer = FeatureTransformer.from_feature_names(transformer)
+    if booster.num_features() != transformer.n_features:
+        raise ValueError(f'The model expects {booster.num_features()} features but {transformer.n_features} were given')
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, NATIVE_MODEL_NAME)
+    schema_path = os.path.join(output_dir, FEATURE_SCHEMA_NAME)
+    booster.save_model(model_path)
+    with open(schema_path, 'w') as f:
+        json.dump(transformer.to_schema(), f, separators=(',', ':'))
+    return model_path, schema_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a pickled model to the native XGBoost format')
+    parser.add_argument('model', help='Pickled XGBRegressor')
+    parser.add_argument('feature_names', help='Pickled list of feature names')
+    parser.add_argument('--output-dir', default='app')
+    args = parser.parse_args()
+
+    with open(args.model, 'rb') as f:
+        model = pickle.load(f)
+    with open(args.feature_names, 'rb') as f:
+        feature_names = pickle.load(f)
+    for path in export_native(model, feature_names, args.output_dir):
+        print(f'Wrote {path} ({os.path.getsize(path)} bytes)')
+
+
+if __name__ == '__main__':
+    main()
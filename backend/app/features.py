@@ -0,0 +1,322 @@
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+NUMBER_TYPES = (bool, int, float, np.number)
+
+CATEGORICAL_COLUMNS = ['brand', 'model', 'fuel_type', 'gearbox', 'color', 'seller', 'body_type', 'drivetrain',
+                       'country', 'condition', 'upholstery_color']
+# Columns rebuilt before encoding: at training time `model` becomes `<brand>_<model>`, so the same model name under
+# two brands gets two features
+DERIVED_COLUMNS = {'model': 'brand'}
+SCHEMA_VERSION = 2
+
+
+def feature_schema(feature_names, derived=DERIVED_COLUMNS):
+    # Compact form of the feature list: the numeric columns, then the vocabulary of every one-hot encoded column
+    numeric, categorical = [], {}
+    for name in feature_names:
+        columns = [c for c in CATEGORICAL_COLUMNS if name.startswith(f'{c}_')]
+        if columns:
+            column = max(columns, key=len)
+            categorical.setdefault(column, []).append(name[len(column) + 1:])
+        else:
+            numeric.append(name)
+    schema = {'version': SCHEMA_VERSION, 'numeric': numeric, 'categorical': categorical, 'derived': dict(derived)}
+    if feature_names_from_schema(schema) != list(feature_names):
+        raise ValueError('Feature names are not grouped as numeric columns followed by one-hot columns')
+    return schema
+
+
+def feature_names_from_schema(schema):
+    # Version 1 schemas have no `derived` entry, their models were all trained with the default derivation
+    if schema.get('version') not in (1, SCHEMA_VERSION):
+        raise ValueError(f"Unsupported feature schema version {schema.get('version')}")
+    return schema['numeric'] + [f'{column}_{value}' for column, values in schema['categorical'].items()
+                                for value in values]
+
+
+class FeatureEncoder:
+    """
+    Encodes input records into the model's feature space without going through pandas.
+
+    A record is encoded exactly like `pd.get_dummies(pd.DataFrame([record])).reindex(columns=feature_names,
+    fill_value=0)`: string values switch on their `<key>_<value>` one-hot column, numbers fill the column named
+    after their key and anything that does not match a feature is dropped.
+    """
+
+    def __init__(self, feature_names):
+        self.feature_names = list(feature_names)
+        self.n_features = len(self.feature_names)
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        # Named like feature_schema groups them: a feature is one-hot when it starts with a categorical column
+        self.numeric_slots = np.array([i for i, name in enumerate(self.feature_names)
+                                       if not any(name.startswith(f'{c}_') for c in CATEGORICAL_COLUMNS)],
+                                      dtype=np.int64)
+        # The encoding of a record without any feature, the starting point of every row
+        self.empty_row = np.zeros((1, self.n_features), dtype=np.float32)
+        self._lookups = {}
+        self._local = threading.local()
+
+    def lookup(self, column):
+        # Maps the values of a categorical column to the index of their one-hot feature
+        if column not in self._lookups:
+            prefix = f'{column}_'
+            self._lookups[column] = {name[len(prefix):]: i for name, i in self.index.items()
+                                     if name.startswith(prefix)}
+        return self._lookups[column]
+
+    def entries(self, record):
+        indices, values = [], []
+        for key, value in record.items():
+            if isinstance(value, str):
+                i = self.index.get(f'{key}_{value}')
+                value = 1.0
+            elif isinstance(value, NUMBER_TYPES):
+                i = self.index.get(key)
+            else:
+                continue
+            if i is not None:
+                indices.append(i)
+                values.append(value)
+        return indices, values
+
+    def one_hot_slots(self):
+        return np.setdiff1d(np.arange(self.n_features), self.numeric_slots)
+
+    def row_buffer(self):
+        # One preallocated row per thread, FastAPI runs sync handlers concurrently in a threadpool
+        row = getattr(self._local, 'row', None)
+        if row is None:
+            row = self._local.row = np.zeros((1, self.n_features), dtype=np.float32)
+        return row
+
+    def encode(self, record, out=None):
+        return self.encode_entries(*self.entries(record), out=out)
+
+    def encode_entries(self, indices, values, out=None):
+        if out is None:
+            out = np.zeros((1, self.n_features), dtype=np.float32)
+        else:
+            out.fill(0)
+        out[0, indices] = values
+        return out
+
+    def encode_records(self, records, sparse=False):
+        rows, cols, vals = [], [], []
+        for i, record in enumerate(records):
+            indices, values = self.entries(record)
+            rows.extend([i] * len(indices))
+            cols.extend(indices)
+            vals.extend(values)
+        return self._assemble(len(records), np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64),
+                              np.array(vals, dtype=np.float32), sparse)
+
+    def encode_frame(self, df, sparse=False):
+        # Vectorized version of encode_records for a DataFrame with one record per row
+        n = len(df)
+        rows, cols, vals = [], [], []
+        for column in df.columns:
+            values = df[column]
+            slot = self.index.get(column)
+            if values.dtype.kind in 'biuf':
+                if slot is not None:
+                    rows.append(np.arange(n))
+                    cols.append(np.full(n, slot))
+                    vals.append(values.to_numpy(dtype=np.float32, na_value=np.nan))
+                continue
+            values = values.astype(object)
+            codes = values.map(self.lookup(column)).to_numpy(dtype=np.float64)
+            hot = np.flatnonzero(~np.isnan(codes))
+            rows.append(hot)
+            cols.append(codes[hot].astype(np.int64))
+            vals.append(np.ones(len(hot), dtype=np.float32))
+            if slot is not None:
+                # Numbers mixed into a text column still fill their numeric feature
+                is_number = values.map(lambda v: isinstance(v, NUMBER_TYPES)).to_numpy(dtype=bool)
+                numbers = np.flatnonzero(is_number)
+                rows.append(numbers)
+                cols.append(np.full(len(numbers), slot))
+                vals.append(values[is_number].to_numpy(dtype=np.float32))
+        if not rows:
+            return self._assemble(n, np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32), sparse)
+        return self._assemble(n, np.concatenate(rows), np.concatenate(cols), np.concatenate(vals), sparse)
+
+    def _assemble(self, n, rows, cols, vals, sparse):
+        if sparse:
+            # Numeric features are always stored, 0 when a record does not set them like in the dense matrix, so
+            # only absent one-hot columns are implicit and a NaN number stays a missing value
+            position = np.full(self.n_features, -1, dtype=np.int64)
+            position[self.numeric_slots] = np.arange(len(self.numeric_slots))
+            is_set = np.zeros((n, len(self.numeric_slots)), dtype=bool)
+            numeric = position[cols] >= 0
+            is_set[rows[numeric], position[cols[numeric]]] = True
+            unset_rows, unset = np.nonzero(~is_set)
+            rows = np.concatenate([rows, unset_rows])
+            cols = np.concatenate([cols, self.numeric_slots[unset]])
+            vals = np.concatenate([vals, np.zeros(len(unset), dtype=np.float32)])
+            return sp.csr_matrix((vals, (rows, cols)), shape=(n, self.n_features), dtype=np.float32)
+        out = np.zeros((n, self.n_features), dtype=np.float32)
+        out[rows, cols] = vals
+        return out
+
+
+class FeatureTransformer(FeatureEncoder):
+    """
+    The feature pipeline shared by training and serving: rebuilds the derived columns of a raw listing, then encodes
+    it with FeatureEncoder. It is fitted on the training data, saved with the model as its feature schema and
+    loaded from it by the backend, so requests go through the exact transformation the model was trained on.
+    """
+    encoding = 'one_hot'
+
+    def __init__(self, numeric, categorical, derived=DERIVED_COLUMNS):
+        self.numeric = list(numeric)
+        self.categorical = {column: list(values) for column, values in categorical.items()}
+        self.derived = dict(derived)
+        super().__init__(self.feature_columns())
+        self.numeric_slots = np.arange(len(self.numeric), dtype=np.int64)
+
+    def feature_columns(self):
+        return self.numeric + [f'{column}_{value}' for column, values in self.categorical.items() for value in values]
+
+    @classmethod
+    def fit(cls, df, categorical_columns=CATEGORICAL_COLUMNS, derived=DERIVED_COLUMNS, target='price',
+            exclude=('url',)):
+        # Gives the columns of `pd.get_dummies(derived df, columns=categorical_columns)` in the same order
+        df = derive_frame(df, derived)
+        numeric = [c for c in df.columns if c not in categorical_columns and c != target and c not in exclude]
+        categorical = {column: sorted(df[column].dropna().astype(str).unique()) for column in categorical_columns}
+        return cls(numeric, categorical, derived)
+
+    @classmethod
+    def from_schema(cls, schema):
+        # Schemas without an `encoding` entry are one-hot encoded
+        feature_names_from_schema(schema)
+        transformer_class = TRANSFORMERS[schema.get('encoding', FeatureTransformer.encoding)]
+        return transformer_class(schema['numeric'], schema['categorical'], schema.get('derived', DERIVED_COLUMNS))
+
+    @classmethod
+    def from_feature_names(cls, feature_names):
+        return cls.from_schema(feature_schema(feature_names))
+
+    def to_schema(self):
+        return {'version': SCHEMA_VERSION, 'numeric': self.numeric, 'categorical': self.categorical,
+                'derived': self.derived, 'encoding': self.encoding}
+
+    def derive(self, record):
+        for column, prefix_column in self.derived.items():
+            value, prefix = record.get(column), record.get(prefix_column)
+            # Values already in the derived form are kept as they are
+            if isinstance(value, str) and isinstance(prefix, str) and not value.startswith(f'{prefix}_'):
+                record = {**record, column: f'{prefix}_{value}'}
+        return record
+
+    def derive_frame(self, df):
+        return derive_frame(df, self.derived)
+
+    def entries(self, record):
+        return super().entries(self.derive(record))
+
+    def encode_frame(self, df, sparse=False):
+        return super().encode_frame(self.derive_frame(df), sparse)
+
+    def check_parity(self, df, expected):
+        # Serving encodes single requests record by record and batches as frames, both must reproduce the
+        # training features `expected` of the raw listings `df`
+        expected = np.asarray(expected, dtype=np.float32)
+        for path, matrix in [('record', self.encode_records(df.to_dict('records'))), ('frame', self.encode_frame(df))]:
+            differs = (matrix != expected) & ~(np.isnan(matrix) & np.isnan(expected))
+            rows = np.flatnonzero(differs.any(axis=1))
+            if rows.size:
+                columns = [self.feature_names[i] for i in np.flatnonzero(differs[rows[0]])]
+                raise ValueError(f'{rows.size} of {len(df)} rows differ from the training features when encoded '
+                                 f'per {path}, the first one at {columns}')
+
+
+class CategoricalTransformer(FeatureTransformer):
+    """
+    Feature pipeline of the models trained with XGBoost's native categorical support. There is one feature per
+    column: categorical ones hold the position of the value in the column's vocabulary, or NaN when the value is
+    unknown or absent. The matrices are dense whatever `sparse` asks for, with a handful of columns there is nothing
+    to gain and absent numeric values must stay 0, not become missing.
+    """
+    encoding = 'categorical'
+
+    def __init__(self, numeric, categorical, derived=DERIVED_COLUMNS):
+        super().__init__(numeric, categorical, derived)
+        self.empty_row = np.zeros((1, self.n_features), dtype=np.float32)
+        self.empty_row[0, len(self.numeric):] = np.nan
+
+    def feature_columns(self):
+        return self.numeric + list(self.categorical)
+
+    def lookup(self, column):
+        if column not in self._lookups:
+            self._lookups[column] = {value: i for i, value in enumerate(self.categorical.get(column, []))}
+        return self._lookups[column]
+
+    def entries(self, record):
+        indices, values = [], []
+        for key, value in self.derive(record).items():
+            i = self.index.get(key)
+            if i is None:
+                continue
+            if key in self.categorical:
+                value = self.lookup(key).get(value) if isinstance(value, str) else None
+            elif not isinstance(value, NUMBER_TYPES):
+                value = None
+            if value is not None:
+                indices.append(i)
+                values.append(value)
+        return indices, values
+
+    def encode_entries(self, indices, values, out=None):
+        if out is None:
+            out = self.empty_row.copy()
+        else:
+            out[:] = self.empty_row
+        out[0, indices] = values
+        return out
+
+    def encode_frame(self, df, sparse=False):
+        df = self.derive_frame(df)
+        out = np.repeat(self.empty_row, len(df), axis=0)
+        for column in df.columns:
+            i = self.index.get(column)
+            if i is None:
+                continue
+            values = df[column]
+            if column in self.categorical:
+                out[:, i] = values.astype(object).map(self.lookup(column)).to_numpy(dtype=np.float32)
+            elif values.dtype.kind in 'biuf':
+                out[:, i] = values.to_numpy(dtype=np.float32, na_value=np.nan)
+            else:
+                is_number = values.map(lambda v: isinstance(v, NUMBER_TYPES)).to_numpy(dtype=bool)
+                out[is_number, i] = values[is_number].to_numpy(dtype=np.float32)
+        return out
+
+    def _assemble(self, n, rows, cols, vals, sparse):
+        out = np.repeat(self.empty_row, n, axis=0)
+        out[rows, cols] = vals
+        return out
+
+
+TRANSFORMERS = {transformer.encoding: transformer for transformer in (FeatureTransformer, CategoricalTransformer)}
+
+
+def derive_frame(df, derived=DERIVED_COLUMNS):
+    # Vectorized FeatureTransformer.derive
+    columns = {}
+    for column, prefix_column in derived.items():
+        if column not in df.columns or prefix_column not in df.columns:
+            continue
+        values, prefixes = df[column].astype(object), df[prefix_column].astype(object)
+        is_text = values.map(type).eq(str) & prefixes.map(type).eq(str)
+        derived_values = values.copy()
+        for prefix in pd.unique(prefixes[is_text]):
+            rows = is_text & prefixes.eq(prefix)
+            rows &= ~values.where(rows, '').str.startswith(f'{prefix}_')
+            derived_values[rows] = f'{prefix}_' + values[rows]
+        columns[column] = derived_values
+    return df.assign(**columns) if columns else df
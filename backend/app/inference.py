@@ -0,0 +1,86 @@
+import json
+import xgboost as xgb
+
+
+def _split_nodes(model_json, features=None):
+    # Numeric splits, on `features` only when given
+    for tree in model_json['learner']['gradient_booster']['model']['trees']:
+        for node, left in enumerate(tree['left_children']):
+            # Leaves have no children and categorical splits do not compare against a threshold
+            if left != -1 and tree['split_type'][node] == 0 and (features is None or
+                                                                 tree['split_indices'][node] in features):
+                yield tree, node
+
+
+def missing_matches_zero(booster, features=None):
+    # XGBoost treats the entries left out of a sparse matrix as missing, so a sparse row only predicts the same as
+    # its dense version when every split on an implicit feature sends missing values down the same branch as 0
+    # (left when 0 < threshold)
+    model_json = json.loads(booster.save_raw('json'))
+    return all(bool(tree['default_left'][node]) == (0 < tree['split_conditions'][node])
+               for tree, node in _split_nodes(model_json, features))
+
+
+def align_missing_with_zero(booster, features=None):
+    # Models trained on dense one-hot frames never saw a missing one-hot value, so those default branches carry no
+    # information. Sending missing values where 0 goes makes sparse and dense inputs predict identically.
+    model_json = json.loads(booster.save_raw('json'))
+    for tree, node in _split_nodes(model_json, features):
+        tree['default_left'][node] = int(0 < tree['split_conditions'][node])
+    return xgb.Booster(model_file=bytearray(json.dumps(model_json).encode()))
+
+
+def sparse_booster(model, one_hot_features=None):
+    # Only the one-hot features are left out of the sparse rows, numeric ones are always stored and a NaN among
+    # them must keep taking the default branch the model learned for it
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    features = None if one_hot_features is None else set(int(i) for i in one_hot_features)
+    if missing_matches_zero(booster, features):
+        return booster
+    return align_missing_with_zero(booster, features)
+
+
+def _renumber(tree):
+    # XGBoost walks a tree assuming every right child directly follows its left child, so after children were
+    # swapped the nodes are numbered again breadth first
+    order = [0]
+    for node in order:
+        if tree['left_children'][node] != -1:
+            order += [tree['left_children'][node], tree['right_children'][node]]
+    new_id = {old: new for new, old in enumerate(order)}
+    new_id[-1] = -1
+    for key, values in tree.items():
+        if isinstance(values, list) and len(values) == len(order):
+            tree[key] = [values[old] for old in order]
+    tree['left_children'] = [new_id[child] for child in tree['left_children']]
+    tree['right_children'] = [new_id[child] for child in tree['right_children']]
+    tree['parents'] = [tree['parents'][0]] + [new_id[parent] for parent in tree['parents'][1:]]
+    tree['categories_nodes'] = [new_id[node] for node in tree['categories_nodes']]
+
+
+def densify_one_hot_splits(booster, one_hot_features):
+    # A model trained on sparse one-hot columns only ever saw 1 or a missing value for them, and may have put 1 on
+    # the side a dense 0 would take. Rewrites those splits so that 0 follows the missing branch and 1 keeps its own,
+    # after which dense, sparse and NaN encoded rows all predict the same.
+    one_hot_features = set(one_hot_features)
+    model_json = json.loads(booster.save_raw('json'))
+    swapped = set()
+    for tree, node in _split_nodes(model_json):
+        if tree['split_indices'][node] not in one_hot_features:
+            continue
+        one_left = 1 < tree['split_conditions'][node]
+        missing_left = bool(tree['default_left'][node])
+        if one_left == missing_left:
+            # Both values take the same branch
+            tree['split_conditions'][node] = 2.0 if one_left else 0.0
+            continue
+        if one_left:
+            tree['left_children'][node], tree['right_children'][node] = \
+                tree['right_children'][node], tree['left_children'][node]
+            swapped.add(id(tree))
+        tree['split_conditions'][node] = 0.5
+        tree['default_left'][node] = 1
+    for tree in model_json['learner']['gradient_booster']['model']['trees']:
+        if id(tree) in swapped:
+            _renumber(tree)
+    return xgb.Booster(model_file=bytearray(json.dumps(model_json).encode()))
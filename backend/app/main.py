@@ -1,23 +1,355 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from itertools import groupby
+import argparse
+import gc
+import json
+import logging
+import os
 import pickle
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
 import pandas as pd
+import xgboost as xgb
+from app.batching import MicroBatcher, QueueFull
+from app.cache import FileWatcher, PredictionCache, cache_key
+from app.features import FeatureTransformer
+from app.inference import sparse_booster
+from app.metrics import BATCH_SIZE, REQUEST_LATENCY, REQUESTS, STAGE_LATENCY, FunctionMetric, registry
+from app.profiling import SlowRequestProfiler
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-with open('app/xgbr_price_predictor.pkl', 'rb') as f:
-    model = pickle.load(f)
-with open('app/feature_names.pkl', 'rb') as f:
-    feature_names = pickle.load(f)
+# The native model and feature schema written by app.export_model are preferred, the pickles are a fallback.
+# MODEL_VARIANT=<name> serves the compact variant exported to app/variants/<name>/ by notebooks/variants.py instead.
+MODEL_VARIANT = os.environ.get('MODEL_VARIANT', '')
+MODEL_DIR = os.path.join('app', 'variants', MODEL_VARIANT) if MODEL_VARIANT else 'app'
+NATIVE_MODEL_PATH = os.path.join(MODEL_DIR, 'xgbr_price_predictor.ubj')
+FEATURE_SCHEMA_PATH = os.path.join(MODEL_DIR, 'feature_schema.json')
+PICKLE_MODEL_PATH = 'app/xgbr_price_predictor.pkl'
+FEATURE_NAMES_PATH = 'app/feature_names.pkl'
+
+# Number of rows encoded and scored at once by the batch endpoints, this bounds the size of the feature matrix
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 10000))
+
+# XGBoost threads per process, set it to 1 when running several workers on the same cores
+XGBOOST_NTHREAD = int(os.environ.get('XGBOOST_NTHREAD', 0))
+
+# 'sparse' keeps batch features as CSR matrices from encoding to prediction instead of dense float32 chunks
+INFERENCE_MODE = os.environ.get('INFERENCE_MODE', 'dense')
+SPARSE = INFERENCE_MODE == 'sparse'
+
+# MICRO_BATCH=1 gathers concurrent /predict calls into one model call per MICRO_BATCH_MAX_WAIT_MS
+MICRO_BATCH = os.environ.get('MICRO_BATCH', '0') == '1'
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 64))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', 2))
+MICRO_BATCH_QUEUE_SIZE = int(os.environ.get('MICRO_BATCH_QUEUE_SIZE', 1024))
+
+# Opt-in sampling profiler: PROFILE_SAMPLE_RATE of the requests are profiled and kept in PROFILE_DIR when they take
+# longer than PROFILE_SLOW_REQUESTS_MS
+PROFILE_SLOW_REQUESTS_MS = os.environ.get('PROFILE_SLOW_REQUESTS_MS')
+profiler = None
+if PROFILE_SLOW_REQUESTS_MS:
+    profiler = SlowRequestProfiler(threshold=float(PROFILE_SLOW_REQUESTS_MS) / 1000,
+                                   sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01)),
+                                   directory=os.environ.get('PROFILE_DIR', 'profiles'))
+
+Artifacts = namedtuple('Artifacts', ['booster', 'encoder', 'batch_booster'])
+
+
+def artifact_paths():
+    # A missing variant is an error rather than a silent fallback to the default model
+    if MODEL_VARIANT or (os.path.exists(NATIVE_MODEL_PATH) and os.path.exists(FEATURE_SCHEMA_PATH)):
+        return NATIVE_MODEL_PATH, FEATURE_SCHEMA_PATH
+    return PICKLE_MODEL_PATH, FEATURE_NAMES_PATH
+
+
+def load_booster(model_path, features_path):
+    if model_path.endswith('.pkl'):
+        with open(model_path, 'rb') as f:
+            booster = pickle.load(f).get_booster()
+        with open(features_path, 'rb') as f:
+            transformer = FeatureTransformer.from_feature_names(pickle.load(f))
+    else:
+        booster = xgb.Booster(model_file=model_path)
+        with open(features_path) as f:
+            transformer = FeatureTransformer.from_schema(json.load(f))
+    return booster, transformer
+
+
+def load_artifacts(model_path=None, features_path=None):
+    if model_path is None:
+        model_path, features_path = artifact_paths()
+    started = time.perf_counter()
+    booster, transformer = load_booster(model_path, features_path)
+    # Only one-hot features are sparse, the other encodings always give dense matrices
+    batch_booster = booster
+    if SPARSE and transformer.encoding == 'one_hot':
+        batch_booster = sparse_booster(booster, transformer.one_hot_slots())
+    if XGBOOST_NTHREAD:
+        booster.set_param('nthread', XGBOOST_NTHREAD)
+        batch_booster.set_param('nthread', XGBOOST_NTHREAD)
+    logger.info('Loaded %s in %.3fs', model_path, time.perf_counter() - started)
+    return Artifacts(booster, transformer, batch_booster)
+
+
+model_files = FileWatcher([NATIVE_MODEL_PATH, FEATURE_SCHEMA_PATH, PICKLE_MODEL_PATH, FEATURE_NAMES_PATH],
+                          interval=float(os.environ.get('MODEL_CHECK_INTERVAL', 1)))
+# Loaded on first use, so importing the app (and every worker starting) does not pay for the model
+artifacts = None
+reload_lock = threading.Lock()
+
+cache = PredictionCache(max_size=int(os.environ.get('PREDICTION_CACHE_SIZE', 4096)),
+                        ttl=float(os.environ.get('PREDICTION_CACHE_TTL', 3600)))
+
+
+def current_artifacts():
+    # Reloads the model when its files change on disk, cached predictions of the previous model are dropped
+    global artifacts
+    if artifacts is None:
+        with reload_lock:
+            if artifacts is None:
+                fingerprint = model_files.fingerprint()
+                artifacts = load_artifacts()
+                model_files.refresh(fingerprint)
+    elif model_files.changed():
+        with reload_lock:
+            fingerprint = model_files.fingerprint()
+            try:
+                artifacts = load_artifacts()
+            except Exception:
+                logger.exception('Could not reload the model, keeping the previous one')
+            else:
+                model_files.refresh(fingerprint)
+                cache.clear()
+    return artifacts
+
+
+def preload():
+    # Called by the gunicorn master before forking: the workers inherit the loaded model, and freezing the
+    # collector keeps it from writing to (and so copying) the pages of every object allocated so far
+    current_artifacts()
+    gc.freeze()
+
+
+def warm_up():
+    # A first prediction in each worker sets up XGBoost's predictor before real traffic arrives. It must not run
+    # in the master, OpenMP thread pools do not survive a fork.
+    current = current_artifacts()
+    current.booster.inplace_predict(current.encoder.encode({}))
+    current.batch_booster.inplace_predict(current.encoder.encode_records([{}], sparse=SPARSE))
+
+
+def predict_entries(items):
+    # items are (artifacts, indices, values, enqueued_at) tuples from concurrent requests, scored with one call
+    # per model
+    started = time.perf_counter()
+    predictions = []
+    for current, group in groupby(items, key=lambda item: item[0]):
+        group = list(group)
+        # Absent categorical features are NaN rather than 0 for the models with native categorical support
+        matrix = np.repeat(current.encoder.empty_row, len(group), axis=0)
+        for row, (_, indices, values, enqueued_at) in enumerate(group):
+            matrix[row, indices] = values
+            STAGE_LATENCY.observe(started - enqueued_at, stage='queue')
+        with STAGE_LATENCY.time(stage='predict'):
+            predictions.extend(current.booster.inplace_predict(matrix).astype(float).tolist())
+        BATCH_SIZE.observe(len(group), source='micro_batch')
+    return predictions
+
+
+batcher = MicroBatcher(predict_entries, max_batch_size=MICRO_BATCH_MAX_SIZE, max_wait=MICRO_BATCH_MAX_WAIT_MS / 1000,
+                       max_queue_size=MICRO_BATCH_QUEUE_SIZE) if MICRO_BATCH else None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if batcher is not None:
+        await batcher.start()
+    yield
+    if batcher is not None:
+        await batcher.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+registry.register(FunctionMetric('predictor_cache_hits_total', 'Predictions answered from the cache',
+                                 lambda: cache.hits, kind='counter'))
+registry.register(FunctionMetric('predictor_cache_misses_total', 'Predictions not found in the cache',
+                                 lambda: cache.misses, kind='counter'))
+registry.register(FunctionMetric('predictor_cache_evictions_total', 'Least recently used predictions dropped',
+                                 lambda: cache.evictions, kind='counter'))
+registry.register(FunctionMetric('predictor_cache_expirations_total', 'Predictions dropped after their TTL',
+                                 lambda: cache.expirations, kind='counter'))
+registry.register(FunctionMetric('predictor_cache_size', 'Predictions currently cached', lambda: len(cache)))
+registry.register(FunctionMetric('predictor_batch_queue_size', 'Predictions waiting for the micro-batcher',
+                                 lambda: batcher.queue_size() if batcher is not None else 0))
+
+
+@app.middleware('http')
+async def record_metrics(request: Request, call_next):
+    started = request.state.started = time.perf_counter()
+    sampler = profiler.start() if profiler is not None else None
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        route = getattr(request.scope.get('route'), 'path', 'unmatched')
+        REQUESTS.inc(route=route, status=status)
+        REQUEST_LATENCY.observe(elapsed, route=route)
+        if sampler is not None:
+            # Joining the sampler thread and writing the profile would block the event loop
+            path = await run_in_threadpool(profiler.finish, sampler, route, elapsed)
+            if path is not None:
+                logger.warning('%s took %.0fms, profile written to %s', route, elapsed * 1e3, path)
+
+
+def observe_parse(http_request):
+    # Routing, reading the body and validating it, up to the start of the handler
+    STAGE_LATENCY.observe(time.perf_counter() - http_request.state.started, stage='parse')
 
 
 class PredictionRequest(BaseModel):
     input_data: dict
 
 
+class BatchPredictionRequest(BaseModel):
+    input_data: list[dict]
+
+
+def predict_chunks(current, chunks, source):
+    chunks = iter(chunks)
+    predictions = []
+    while True:
+        # Chunks are encoded (and uploads read) lazily, when the next one is requested
+        with STAGE_LATENCY.time(stage='encode'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        if not chunk.shape[0]:
+            continue
+        with STAGE_LATENCY.time(stage='predict'):
+            predictions.append(current.batch_booster.inplace_predict(chunk))
+        BATCH_SIZE.observe(chunk.shape[0], source=source)
+    if not predictions:
+        return []
+    return np.concatenate(predictions).astype(float).tolist()
+
+
+def read_upload(file):
+    name = (file.filename or '').lower()
+    if name.endswith('.csv') or file.content_type == 'text/csv':
+        return pd.read_csv(file.file, chunksize=BATCH_CHUNK_SIZE)
+    if name.endswith(('.ndjson', '.jsonl')) or file.content_type in ('application/x-ndjson', 'application/jsonl'):
+        return pd.read_json(file.file, lines=True, chunksize=BATCH_CHUNK_SIZE)
+    raise HTTPException(status_code=415, detail='Upload a .csv or .ndjson file')
+
+
+def predict_one(current, indices, values):
+    row = current.encoder.encode_entries(indices, values, out=current.encoder.row_buffer())
+    with STAGE_LATENCY.time(stage='predict'):
+        prediction = float(current.booster.inplace_predict(row)[0])
+    BATCH_SIZE.observe(1, source='single')
+    return prediction
+
+
 @app.post('/predict')
-def predict(request: PredictionRequest):
-    input_df = pd.DataFrame([request.input_data])
-    input_df = pd.get_dummies(input_df).reindex(columns=feature_names, fill_value=0)
-    prediction = model.predict(input_df)[0]
-    return {"prediction": float(prediction)}
+async def predict(request: PredictionRequest, http_request: Request):
+    observe_parse(http_request)
+    # Read before the model, a reload while this request waits then keeps its prediction out of the cache
+    generation = cache.generation
+    # A reload, or waiting for the one another request started, must not block the event loop and the micro-batcher
+    current = await run_in_threadpool(current_artifacts)
+    with STAGE_LATENCY.time(stage='encode'):
+        indices, values = current.encoder.entries(request.input_data)
+        key = cache_key(indices, values)
+    with STAGE_LATENCY.time(stage='cache'):
+        prediction = cache.get(key)
+    if prediction is None:
+        if batcher is None:
+            prediction = await run_in_threadpool(predict_one, current, indices, values)
+        else:
+            try:
+                prediction = await batcher.submit((current, indices, values, time.perf_counter()))
+            except QueueFull as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+        cache.put(key, prediction, generation)
+    return {"prediction": prediction}
+
+
+@app.post('/predict/batch')
+def predict_batch(request: BatchPredictionRequest, http_request: Request):
+    observe_parse(http_request)
+    current = current_artifacts()
+    records = request.input_data
+    chunks = (current.encoder.encode_records(records[i:i + BATCH_CHUNK_SIZE], sparse=SPARSE)
+              for i in range(0, len(records), BATCH_CHUNK_SIZE))
+    return {"predictions": predict_chunks(current, chunks, 'batch')}
+
+
+@app.post('/predict/batch/upload')
+def predict_batch_upload(http_request: Request, file: UploadFile = File(...)):
+    observe_parse(http_request)
+    current = current_artifacts()
+    try:
+        predictions = predict_chunks(current, (current.encoder.encode_frame(chunk, sparse=SPARSE)
+                                               for chunk in read_upload(file)), 'upload')
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"predictions": predictions}
+
+
+@app.get('/cache/stats')
+def cache_stats():
+    return cache.stats()
+
+
+@app.get('/metrics')
+def metrics():
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
+
+
+def profile_startup():
+    # Cold import in a fresh interpreter, then the load and first predictions of each model format
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import app.main'], check=True)
+    print(f'import app.main (fresh process): {time.perf_counter() - started:.3f}s')
+
+    example = {'brand': 'audi', 'model': 'audi_a4', 'fuel_type': 'diesel', 'gearbox': 'manual', 'mileage': 100000,
+               'power': 110, 'year': 2015}
+    for label, paths in (('native', (NATIVE_MODEL_PATH, FEATURE_SCHEMA_PATH)),
+                         ('pickle', (PICKLE_MODEL_PATH, FEATURE_NAMES_PATH))):
+        if not all(os.path.exists(path) for path in paths):
+            print(f'{label}: not found')
+            continue
+        started = time.perf_counter()
+        loaded = load_artifacts(*paths)
+        load_time = time.perf_counter() - started
+        latencies = []
+        for _ in range(2):
+            started = time.perf_counter()
+            loaded.booster.inplace_predict(loaded.encoder.encode(example))
+            latencies.append(time.perf_counter() - started)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f'{label}: load {load_time:.3f}s, first prediction {latencies[0] * 1e3:.2f}ms, '
+              f'second prediction {latencies[1] * 1e3:.2f}ms, {size / 1e6:.2f} MB on disk')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Car price prediction backend')
+    parser.add_argument('--startup-profile', action='store_true', help='Measure cold-start time and exit')
+    args = parser.parse_args()
+    if args.startup_profile:
+        profile_startup()
+    else:
+        parser.print_help()
@@ -0,0 +1,78 @@
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+
+class StackSampler:
+    """
+    Sampling profiler: a background thread records the Python stack of every thread each `interval` seconds.
+    It sees the threadpool and batching threads too, which a tracing profiler started around a request would miss.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        # Collapsed stacks, one "frame;frame;frame count" line each, the input format of flamegraph tools
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class SlowRequestProfiler:
+    """Profiles a `sample_rate` fraction of requests and keeps the profiles of those slower than `threshold`."""
+
+    def __init__(self, threshold, sample_rate, directory):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self._active = threading.Lock()
+
+    def start(self):
+        # One profiled request at a time, the samples of concurrent requests would be mixed up anyway
+        if random.random() >= self.sample_rate or not self._active.acquire(blocking=False):
+            return None
+        sampler = StackSampler()
+        sampler.start()
+        return sampler
+
+    def finish(self, sampler, route, elapsed):
+        sampler.stop()
+        self._active.release()
+        if elapsed < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = route.strip('/').replace('/', '_') or 'root'
+        fd, path = tempfile.mkstemp(prefix=f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{int(elapsed * 1e3)}ms-',
+                                    suffix='.txt', dir=self.directory)
+        os.close(fd)
+        sampler.write(path)
+        return path
@@ -0,0 +1,62 @@
+# Sends /predict requests from concurrent clients and reports throughput and latency percentiles.
+# Run from the backend directory against a running server, for example:
+#   python -m benchmarks.load_test --concurrency 64 --requests 5000
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import numpy as np
+from benchmarks.worker_memory import EXAMPLE
+
+
+def client(url, n_requests, seed, latencies, errors, lock):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    rng = random.Random(seed)
+    for _ in range(n_requests):
+        # A different mileage per request, so the prediction cache does not answer
+        body = json.dumps({'input_data': dict(EXAMPLE, mileage=rng.randrange(300000))})
+        started = time.perf_counter()
+        try:
+            connection.request('POST', parts.path, body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            status = None
+        elapsed = time.perf_counter() - started
+        with lock:
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the /predict endpoint')
+    parser.add_argument('--url', default='http://127.0.0.1:8000/predict')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    latencies, errors, lock = [], {}, threading.Lock()
+    per_client = args.requests // args.concurrency
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for seed in range(args.concurrency):
+            pool.submit(client, args.url, per_client, seed, latencies, errors, lock)
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1e3
+    print(f'{len(latencies)} ok, errors {errors or "none"} in {elapsed:.2f}s with {args.concurrency} clients')
+    print(f'throughput {len(latencies) / elapsed:.0f} req/s, p50 {np.percentile(latencies, 50):.1f}ms, '
+          f'p99 {np.percentile(latencies, 99):.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
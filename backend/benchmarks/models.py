@@ -0,0 +1,191 @@
+# Benchmarks candidate models on a fixed snapshot of listings and stores the results as JSON. Run from the backend
+# directory, the snapshot is written by `python training_data.py <dataset> --snapshot <path>` in notebooks/:
+#   python -m benchmarks.models snapshot.csv app/xgbr_price_predictor.ubj app/xgbr_price_predictor.pkl \
+#       --output results.json
+#   python -m benchmarks.models snapshot.csv new/xgbr_price_predictor.ubj --baseline results.json \
+#       --baseline-model app/xgbr_price_predictor.ubj
+# With --baseline, the exit status is 1 when a model is less accurate, slower or larger than its baseline.
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import platform
+import sys
+import time
+import warnings
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from app.export_model import FEATURE_SCHEMA_NAME
+from app.features import FeatureTransformer
+
+FEATURE_NAMES_NAME = 'feature_names.pkl'
+TARGET = 'price'
+
+# Relative changes from the baseline that count as a regression. Timings use the --timing-tolerance margin instead,
+# they vary from run to run and between machines.
+TOLERANCES = {'rmse': 0.01, 'mae': 0.01, 'model_bytes': 0.05}
+HIGHER_IS_BETTER = {'r2': 0.01}
+TIMINGS = ['p50_ms', 'p99_ms', 'load_seconds']
+HIGHER_IS_BETTER_TIMINGS = ['rows_per_second']
+
+
+def candidate_paths(spec):
+    # 'model_path' or 'model_path:features_path', the features default to the file exported next to the model
+    model_path, _, features_path = spec.partition(':')
+    if not features_path:
+        name = FEATURE_NAMES_NAME if model_path.endswith('.pkl') else FEATURE_SCHEMA_NAME
+        features_path = os.path.join(os.path.dirname(model_path), name)
+    return model_path, features_path
+
+
+def load_model(model_path, features_path):
+    # Returns a predict function taking a feature matrix, loaded like the backend loads its model
+    if model_path.endswith('.pkl'):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            with open(model_path, 'rb') as f:
+                model = pickle.load(f)
+        with open(features_path, 'rb') as f:
+            transformer = FeatureTransformer.from_feature_names(pickle.load(f))
+        # Other scikit-learn regressors, like the notebook's random forest, are called directly
+        predict = model.get_booster().inplace_predict if hasattr(model, 'get_booster') else model.predict
+        return predict, transformer
+    booster = xgb.Booster(model_file=model_path)
+    with open(features_path) as f:
+        transformer = FeatureTransformer.from_schema(json.load(f))
+    return booster.inplace_predict, transformer
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def predict_frame(predict, transformer, df, batch_size):
+    return np.concatenate([predict(transformer.encode_frame(df.iloc[start:start + batch_size]))
+                           for start in range(0, len(df), batch_size)])
+
+
+def single_row_latencies(predict, transformer, records, warmup=20):
+    # The /predict path: one record encoded into a preallocated row, then scored on its own
+    row = transformer.row_buffer()
+    latencies = []
+    for i, record in enumerate(records):
+        started = time.perf_counter()
+        predict(transformer.encode_entries(*transformer.entries(record), out=row))
+        if i >= warmup:
+            latencies.append(time.perf_counter() - started)
+    return np.array(latencies) * 1e3
+
+
+def benchmark(spec, df, y, latency_rows, batch_size, repeats):
+    model_path, features_path = candidate_paths(spec)
+    load_times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        predict, transformer = load_model(model_path, features_path)
+        load_times.append(time.perf_counter() - started)
+
+    predictions = predict_frame(predict, transformer, df, batch_size)
+    batch_times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        predict_frame(predict, transformer, df, batch_size)
+        batch_times.append(time.perf_counter() - started)
+    records = df.head(latency_rows).to_dict('records')
+    latencies = single_row_latencies(predict, transformer, records)
+
+    return {
+        'model_path': model_path,
+        'features_path': features_path,
+        'rmse': float(np.sqrt(mean_squared_error(y, predictions))),
+        'mae': float(mean_absolute_error(y, predictions)),
+        'r2': float(r2_score(y, predictions)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'rows_per_second': float(len(df) / min(batch_times)),
+        'model_bytes': os.path.getsize(model_path),
+        'features_bytes': os.path.getsize(features_path),
+        'load_seconds': float(np.median(load_times)),
+    }
+
+
+def regressions(results, baseline, baseline_model=None, timing_tolerance=0.25):
+    # Compares every model with the baseline entry of the same name, or with `baseline_model` when given
+    upper = {**TOLERANCES, **dict.fromkeys(TIMINGS, timing_tolerance)}
+    lower = {**HIGHER_IS_BETTER, **dict.fromkeys(HIGHER_IS_BETTER_TIMINGS, timing_tolerance)}
+    found = []
+    if results['snapshot']['sha256'] != baseline['snapshot']['sha256']:
+        print('Warning: the baseline was measured on another snapshot', file=sys.stderr)
+    for name, metrics in results['models'].items():
+        reference = baseline['models'].get(baseline_model or name)
+        if reference is None:
+            continue
+        for metric, tolerance in upper.items():
+            if metrics[metric] > reference[metric] * (1 + tolerance):
+                found.append((name, metric, reference[metric], metrics[metric]))
+        for metric, tolerance in lower.items():
+            if metrics[metric] < reference[metric] - abs(reference[metric]) * tolerance:
+                found.append((name, metric, reference[metric], metrics[metric]))
+    return found
+
+
+def print_results(results):
+    print(f'Snapshot {results["snapshot"]["path"]}: {results["snapshot"]["rows"]} rows')
+    print(f'{"model":>40} {"rmse":>10} {"mae":>10} {"r2":>7} {"p50 ms":>8} {"p99 ms":>8} {"rows/s":>10} '
+          f'{"size MB":>8} {"load s":>7}')
+    for name, m in results['models'].items():
+        print(f'{name[-40:]:>40} {m["rmse"]:>10.1f} {m["mae"]:>10.1f} {m["r2"]:>7.4f} {m["p50_ms"]:>8.3f} '
+              f'{m["p99_ms"]:>8.3f} {m["rows_per_second"]:>10.0f} {m["model_bytes"] / 1e6:>8.2f} '
+              f'{m["load_seconds"]:>7.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark models for accuracy, latency, throughput and size')
+    parser.add_argument('snapshot', help='CSV of cleaned listings with their price')
+    parser.add_argument('models', nargs='+', help="model paths, or 'model_path:features_path'")
+    parser.add_argument('--latency-rows', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='results JSON to check for regressions against')
+    parser.add_argument('--baseline-model', default=None, help='baseline entry every model is compared with')
+    parser.add_argument('--timing-tolerance', type=float, default=0.25,
+                        help='relative slowdown of latency, throughput and load time allowed against the baseline')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.snapshot)
+    y = df.pop(TARGET).to_numpy(dtype=np.float64)
+    df = df.drop(columns='url', errors='ignore')
+    results = {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'snapshot': {'path': args.snapshot, 'rows': len(df), 'sha256': file_sha256(args.snapshot)},
+        'environment': {'python': platform.python_version(), 'xgboost': xgb.__version__,
+                        'scikit-learn': sklearn.__version__, 'machine': platform.machine(),
+                        'cpus': os.cpu_count()},
+        'settings': {'latency_rows': args.latency_rows, 'batch_size': args.batch_size, 'repeats': args.repeats},
+        'models': {spec: benchmark(spec, df, y, args.latency_rows, args.batch_size, args.repeats)
+                   for spec in args.models},
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.baseline_model, args.timing_tolerance)
+        for name, metric, before, after in found:
+            print(f'Regression: {name} {metric} {before:.6g} -> {after:.6g}')
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Checks that a model predicts the same through every serving path: single requests (predict_one), the micro-batcher
+# (predict_entries) and the batch endpoints, dense and sparse, on listings with absent, missing and unknown values.
+# Run from the backend directory, by default on the model in app/ and every variant in app/variants/:
+#   python -m benchmarks.serving_parity
+#   python -m benchmarks.serving_parity app/variants/categorical --rows 1000
+# The exit status is 1 when a path differs from the single requests.
+import argparse
+import glob
+import os
+import sys
+import time
+import numpy as np
+from app.export_model import FEATURE_SCHEMA_NAME, NATIVE_MODEL_NAME
+from app.inference import sparse_booster
+from app.main import (FEATURE_NAMES_PATH, PICKLE_MODEL_PATH, load_artifacts, predict_chunks, predict_entries,
+                      predict_one)
+from benchmarks.sparse_vs_dense import NUMERIC_RANGES
+
+
+def model_paths(model_dir):
+    model_path = os.path.join(model_dir, NATIVE_MODEL_NAME)
+    features_path = os.path.join(model_dir, FEATURE_SCHEMA_NAME)
+    if os.path.exists(model_path) and os.path.exists(features_path):
+        return model_path, features_path
+    return PICKLE_MODEL_PATH, FEATURE_NAMES_PATH
+
+
+def synthetic_records(transformer, n_rows, seed=0):
+    # Every feature is left out of some records, numbers are NaN and categories unknown in some others
+    rng = np.random.default_rng(seed)
+    records = []
+    for _ in range(n_rows):
+        record = {}
+        for column in transformer.numeric:
+            if column in NUMERIC_RANGES:
+                draw = rng.random()
+                if draw < 0.1:
+                    record[column] = float('nan')
+                elif draw > 0.2:
+                    record[column] = int(rng.integers(*NUMERIC_RANGES[column]))
+        for column, values in transformer.categorical.items():
+            draw = rng.random()
+            if draw < 0.05:
+                record[column] = 'unknown'
+            elif draw > 0.15:
+                record[column] = values[rng.integers(len(values))]
+        records.append(record)
+    return records
+
+
+def check(model_dir, n_rows):
+    """Returns {path: max abs difference from the single requests} for the model in `model_dir`."""
+    current = load_artifacts(*model_paths(model_dir))
+    encoder = current.encoder
+    records = synthetic_records(encoder, n_rows)
+    entries = [encoder.entries(record) for record in records]
+    single = np.array([predict_one(current, indices, values) for indices, values in entries])
+    queued = [(current, indices, values, time.perf_counter()) for indices, values in entries]
+    paths = {
+        'micro_batch': predict_entries(queued),
+        'batch': predict_chunks(current._replace(batch_booster=current.booster), [encoder.encode_records(records)],
+                                'batch'),
+    }
+    if encoder.encoding == 'one_hot':
+        sparse = current._replace(batch_booster=sparse_booster(current.booster, encoder.one_hot_slots()))
+        paths['sparse_batch'] = predict_chunks(sparse, [encoder.encode_records(records, sparse=True)], 'batch')
+    return {path: float(np.max(np.abs(np.asarray(predictions) - single))) for path, predictions in paths.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the predictions of the serving paths')
+    parser.add_argument('model_dirs', nargs='*', help='directories holding a model and its feature schema')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='largest difference allowed, in price units')
+    args = parser.parse_args()
+
+    failed = False
+    for model_dir in args.model_dirs or ['app', *sorted(glob.glob(os.path.join('app', 'variants', '*')))]:
+        for path, diff in check(model_dir, args.rows).items():
+            ok = diff <= args.tolerance
+            failed |= not ok
+            print(f'{model_dir:>30} {path:>12} max abs diff {diff:.6f} {"ok" if ok else "FAIL"}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
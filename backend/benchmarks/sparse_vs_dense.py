@@ -0,0 +1,80 @@
+# Compares dense and sparse batch inference, run from the backend directory:
+#   python -m benchmarks.sparse_vs_dense --rows 1 100 10000 1000000
+import argparse
+import pickle
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from app.features import FeatureEncoder
+from app.inference import sparse_booster
+
+CATEGORICAL_COLUMNS = ['brand', 'model', 'fuel_type', 'gearbox', 'color', 'seller', 'body_type', 'drivetrain',
+                       'country', 'condition', 'upholstery_color']
+NUMERIC_RANGES = {'mileage': (0, 300000), 'power': (20, 300), 'engine_size': (800, 5000), 'doors': (2, 5),
+                  'seats': (2, 7), 'emission_class': (0, 300), 'year': (1990, 2025)}
+
+
+def synthetic_listings(encoder, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for column in CATEGORICAL_COLUMNS:
+        values = np.array(list(encoder.lookup(column)), dtype=object)
+        data[column] = values[rng.integers(0, len(values), n_rows)]
+    for column, (low, high) in NUMERIC_RANGES.items():
+        # Some numbers are missing, like in scraped listings, which the sparse path must score like the dense one
+        data[column] = np.where(rng.random(n_rows) < 0.05, np.nan, rng.integers(low, high + 1, n_rows))
+    return pd.DataFrame(data)
+
+
+def matrix_nbytes(matrix):
+    if isinstance(matrix, np.ndarray):
+        return matrix.nbytes
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def run(df, encoder, predict, sparse, chunk_size):
+    encode_time = predict_time = 0.0
+    peak_bytes = 0
+    predictions = []
+    for start in range(0, len(df), chunk_size):
+        t0 = time.perf_counter()
+        matrix = encoder.encode_frame(df.iloc[start:start + chunk_size], sparse=sparse)
+        t1 = time.perf_counter()
+        predictions.append(predict(matrix))
+        t2 = time.perf_counter()
+        encode_time += t1 - t0
+        predict_time += t2 - t1
+        peak_bytes = max(peak_bytes, matrix_nbytes(matrix))
+    return encode_time, predict_time, peak_bytes, np.concatenate(predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dense against sparse batch inference')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 100, 10000, 1000000])
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with open('app/xgbr_price_predictor.pkl', 'rb') as f:
+            model = pickle.load(f)
+    with open('app/feature_names.pkl', 'rb') as f:
+        encoder = FeatureEncoder(pickle.load(f))
+    booster = sparse_booster(model, encoder.one_hot_slots())
+
+    print(f"{'rows':>9} {'mode':>6} {'encode s':>9} {'predict s':>10} {'rows/s':>11} {'peak matrix MB':>15} "
+          f"{'max abs diff':>13}")
+    for n_rows in args.rows:
+        df = synthetic_listings(encoder, n_rows)
+        dense = run(df, encoder, model.predict, False, args.chunk_size)
+        sparse = run(df, encoder, booster.inplace_predict, True, args.chunk_size)
+        diff = float(np.max(np.abs(dense[3] - sparse[3])))
+        for mode, (encode_time, predict_time, peak_bytes, _) in (('dense', dense), ('sparse', sparse)):
+            total = encode_time + predict_time
+            print(f'{n_rows:>9} {mode:>6} {encode_time:>9.4f} {predict_time:>10.4f} {n_rows / total:>11.0f} '
+                  f'{peak_bytes / 1e6:>15.2f} {diff if mode == "sparse" else 0:>13.6f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Starts a server command, sends it some predictions and reports the memory of its processes (Linux only).
+# Run from the backend directory, for example:
+#   python -m benchmarks.worker_memory -- uvicorn app.main:app --workers 4
+#   WEB_CONCURRENCY=4 python -m benchmarks.worker_memory -- gunicorn -c gunicorn.conf.py app.main:app
+import argparse
+import json
+import os
+import signal
+import subprocess
+import time
+import urllib.request
+
+EXAMPLE = {'brand': 'audi', 'model': 'audi_a4', 'fuel_type': 'diesel', 'gearbox': 'manual', 'color': 'black',
+           'seller': 'dealer', 'body_type': 'sedan', 'drivetrain': 'front', 'country': 'de', 'condition': 'used',
+           'upholstery_color': 'black', 'mileage': 100000, 'power': 110, 'engine_size': 1968, 'doors': 4, 'seats': 5,
+           'emission_class': 120, 'year': 2015}
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if ppid == pid:
+            found.append(int(entry))
+            found.extend(children(int(entry)))
+    return found
+
+
+def memory(pid):
+    # RSS counts shared pages in full, PSS splits them between the processes sharing them, USS is private memory
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'rss': values['Rss'], 'pss': values['Pss'],
+            'uss': values['Private_Clean'] + values['Private_Dirty']}
+
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.load(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-process memory of a serving command')
+    parser.add_argument('--url', default='http://127.0.0.1:8000/predict')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+
+    server = subprocess.Popen(command)
+    try:
+        started = time.perf_counter()
+        while True:
+            try:
+                post(args.url, {'input_data': EXAMPLE})
+                break
+            except OSError:
+                if time.perf_counter() - started > args.timeout:
+                    raise
+                time.sleep(0.2)
+        print(f'first prediction answered after {time.perf_counter() - started:.2f}s')
+        for i in range(args.requests):
+            post(args.url, {'input_data': dict(EXAMPLE, mileage=i)})
+
+        total = {'rss': 0.0, 'pss': 0.0, 'uss': 0.0}
+        for pid in [server.pid] + children(server.pid):
+            usage = memory(pid)
+            for key in total:
+                total[key] += usage[key]
+            print(f"pid {pid}: rss {usage['rss']:.1f} MB, pss {usage['pss']:.1f} MB, uss {usage['uss']:.1f} MB")
+        print(f"total: rss {total['rss']:.1f} MB, pss {total['pss']:.1f} MB, uss {total['uss']:.1f} MB")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
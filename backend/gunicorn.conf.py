@@ -0,0 +1,20 @@
+# Multi-worker serving: the model is loaded once in the master and shared by the forked workers copy-on-write.
+#   gunicorn -c gunicorn.conf.py app.main:app
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'uvicorn_worker.UvicornWorker'
+# Import the app in the master before forking, so the libraries and the model are in memory pages the workers share
+preload_app = True
+
+
+def on_starting(server):
+    from app.main import preload
+    preload()
+
+
+def post_worker_init(worker):
+    # Runs in each worker before it accepts connections
+    from app.main import warm_up
+    warm_up()
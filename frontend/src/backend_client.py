@@ -0,0 +1,131 @@
+import itertools
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {502, 503, 504}
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend after `failure_threshold` consecutive failures. Once `reset_timeout` seconds
+    have passed, a single trial request is let through and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class BackendClient:
+    """
+    Shared client for the prediction backend. Connections are pooled and kept alive, requests are spread round-robin
+    over `base_urls`, and a failed request is retried on the next backend after an exponential backoff with full
+    jitter. Backends whose circuit is open are skipped.
+    """
+
+    def __init__(self, base_urls, connect_timeout=2.0, read_timeout=10.0, retries=2, backoff=0.1, max_backoff=2.0,
+                 pool_size=10, failure_threshold=5, reset_timeout=30.0):
+        self.base_urls = [url.rstrip('/') for url in base_urls]
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breakers = {url: CircuitBreaker(failure_threshold, reset_timeout) for url in self.base_urls}
+        self._next = itertools.cycle(self.base_urls)
+        self._next_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.base_urls), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_env(cls):
+        # BACKEND_URL may list several comma separated replicas
+        urls = [url.strip() for url in os.environ.get('BACKEND_URL', 'http://backend:8000').split(',') if url.strip()]
+        return cls(urls,
+                   connect_timeout=float(os.environ.get('BACKEND_CONNECT_TIMEOUT', 2.0)),
+                   read_timeout=float(os.environ.get('BACKEND_READ_TIMEOUT', 10.0)),
+                   retries=int(os.environ.get('BACKEND_RETRIES', 2)),
+                   pool_size=int(os.environ.get('BACKEND_POOL_SIZE', 10)))
+
+    def _pick(self):
+        with self._next_lock:
+            for _ in range(len(self.base_urls)):
+                url = next(self._next)
+                if self.breakers[url].allow():
+                    return url
+        return None
+
+    def _sleep(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        time.sleep(delay)
+
+    def post(self, path, payload):
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._sleep(attempt - 1, getattr(error, 'retry_after', None))
+            url = self._pick()
+            if url is None:
+                raise BackendUnavailable('No backend is available, all circuits are open') from error
+            breaker = self.breakers[url]
+            try:
+                response = self.session.post(url + path, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.record_failure()
+                error = e
+                continue
+            if response.status_code in RETRY_STATUSES:
+                breaker.record_failure()
+                error = requests.HTTPError(f'{response.status_code} from {url}{path}', response=response)
+                retry_after = response.headers.get('Retry-After')
+                error.retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+                continue
+            # A 4xx is an answer to a bad request from a working backend, any other 5xx counts against the backend
+            # without being retried
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            response.raise_for_status()
+            return response.json()
+        raise BackendUnavailable(f'Backend request failed after {self.retries + 1} attempts: {error}') from error
+
+    def predict(self, input_data):
+        return self.post('/predict', {'input_data': input_data})
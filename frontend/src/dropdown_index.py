@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import pandas as pd
+import pyarrow.dataset as ds
+
+OPTION_COLUMNS = ['brand', 'model', 'fuel_type', 'gearbox', 'color', 'seller', 'body_type', 'drivetrain', 'country',
+                  'condition', 'upholstery_color']
+
+
+def read_chunks(path, chunksize):
+    # `path` is either the cleaned listings CSV or the brand/scrape_date partitioned Parquet dataset
+    if os.path.isdir(path):
+        dataset = ds.dataset(path, format='parquet', partitioning='hive')
+        columns = [c for c in OPTION_COLUMNS if c in dataset.schema.names]
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+        yield from pd.read_csv(path, usecols=[c for c in OPTION_COLUMNS if c in header], chunksize=chunksize)
+
+
+def build_index(listings_path, chunksize=500_000):
+    # Streams the listings once and keeps only the distinct values, so the full dataset never sits in memory
+    values = {column: set() for column in OPTION_COLUMNS}
+    models = {}
+    for chunk in read_chunks(listings_path, chunksize):
+        columns = [c for c in OPTION_COLUMNS if c in chunk.columns]
+        for column in columns:
+            values[column].update(chunk[column].dropna().unique())
+        if 'brand' in columns and 'model' in columns:
+            # Models keep the order in which they first appear for their brand, like `unique()` did
+            pairs = chunk[['brand', 'model']].dropna().drop_duplicates()
+            for brand, model in pairs.itertuples(index=False):
+                models.setdefault(brand, {}).setdefault(model, None)
+    return {
+        'options': {column: sorted(values[column]) for column in OPTION_COLUMNS},
+        'models': {brand: list(brand_models) for brand, brand_models in models.items()},
+    }
+
+
+def write_index(index, path):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+def modified_at(path):
+    # Rewriting a partition does not touch the dataset directory itself, so every file is checked
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    return max((os.path.getmtime(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names),
+               default=0)
+
+
+def load_index(index_path, listings_path):
+    # The prebuilt index is used as long as it is newer than the listings, otherwise it is rebuilt once
+    if os.path.exists(index_path) and (not os.path.exists(listings_path) or
+                                       os.path.getmtime(index_path) >= modified_at(listings_path)):
+        with open(index_path) as f:
+            return json.load(f)
+    index = build_index(listings_path)
+    try:
+        write_index(index, index_path)
+    except OSError:
+        pass
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the dropdown options index from the cleaned listings')
+    parser.add_argument('listings_path', nargs='?', default='../data/cleaned_cars')
+    parser.add_argument('index_path', nargs='?', default='../data/dropdown_index.json')
+    args = parser.parse_args()
+    write_index(build_index(args.listings_path), args.index_path)
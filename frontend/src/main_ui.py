@@ -1,10 +1,12 @@
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
-import pandas as pd
 import dash_bootstrap_components as dbc
 from datetime import datetime
-import requests
+import os
+from backend_client import BackendClient
+from dropdown_index import load_index
+from price_cube import load_cube
 
 
 def classify_emission(value):
@@ -90,26 +92,17 @@ emission_class_map = {
     'Euro 6e': '10'
 }
 
-df = pd.read_csv('/src/data/cleaned_cars.csv')
+dropdown_index = load_index(os.environ.get('DROPDOWN_INDEX_PATH', '/src/data/dropdown_index.json'),
+                            os.environ.get('LISTINGS_PATH', '/src/data/cleaned_cars'))
+dropdown_options = dropdown_index['options']
+brand_models = dropdown_index['models']
 
+# Price statistics of the listings, for the market context shown next to a prediction
+price_cube = load_cube(os.environ.get('PRICE_CUBE_PATH', '/src/data/price_cube.parquet'),
+                       os.environ.get('LISTINGS_PATH', '/src/data/cleaned_cars'))
+MARKET_CONTEXT_MIN_COUNT = int(os.environ.get('MARKET_CONTEXT_MIN_COUNT', 20))
 
-def get_unique_values(df, column):
-    return sorted(df[column].unique()) if column in df.columns else []
-
-
-dropdown_options = {
-    'brand': get_unique_values(df, 'brand'),
-    'model': get_unique_values(df, 'model'),
-    'fuel_type': get_unique_values(df, 'fuel_type'),
-    'gearbox': get_unique_values(df, 'gearbox'),
-    'color': get_unique_values(df, 'color'),
-    'seller': get_unique_values(df, 'seller'),
-    'body_type': get_unique_values(df, 'body_type'),
-    'drivetrain': get_unique_values(df, 'drivetrain'),
-    'country': get_unique_values(df, 'country'),
-    'condition': get_unique_values(df, 'condition'),
-    'upholstery_color': get_unique_values(df, 'upholstery_color')
-}
+backend = BackendClient.from_env()
 
 app = dash.Dash(__name__, external_stylesheets=[
     dbc.themes.YETI,
@@ -164,6 +157,26 @@ app.index_string = '''
 '''
 
 
+def market_context(input_data, prediction):
+    # Prices of the listings most like the car, from the cube rather than the listings themselves
+    context = price_cube.market_context(input_data.get('brand'), input_data.get('model'), input_data.get('year'),
+                                        input_data.get('country'), min_count=MARKET_CONTEXT_MIN_COUNT)
+    if context is None:
+        return html.P('Not enough listings of this brand for a market context.', className='text-center mb-3')
+    filters, statistics = context
+    scope = ' '.join(str(value) for value in filters.values())
+    difference = prediction / statistics['median'] - 1 if statistics['median'] else 0
+    return html.Div([
+        html.H5('Market Context', className='text-center mb-2'),
+        html.P(f"Median price of the {statistics['count']:,} listings of {scope}: {statistics['median']:,.0f} €",
+               className='text-center mb-1'),
+        html.P(f"Half of them are priced between {statistics['q25']:,.0f} € and {statistics['q75']:,.0f} €",
+               className='text-center mb-1'),
+        html.P(f"The predicted value is {abs(difference):.0%} {'above' if difference >= 0 else 'below'} their median",
+               className='text-center mb-3'),
+    ])
+
+
 def create_brand_options(brands):
     return [{'label': html.Span(
         [html.Img(src=f'/assets/brand_logo/{brand.replace(" ", "")}.png', className='brand-logo'), brand]),
@@ -354,8 +367,7 @@ app.layout = dbc.Container([
 def set_model_options(selected_brand):
     if selected_brand is None:
         return []
-    filtered_models = df[df['brand'] == selected_brand]['model'].unique()
-    return [{'label': model, 'value': model} for model in filtered_models]
+    return [{'label': model, 'value': model} for model in brand_models.get(selected_brand, [])]
 
 
 @app.callback(
@@ -548,9 +560,7 @@ def update_output(n_clicks, stored_values, mileage, power, engine_size, doors, s
         ]), ''
 
     try:
-        response = requests.post("http://backend:8000/predict", json={"input_data": input_data})
-        response.raise_for_status()
-        prediction_result = response.json()
+        prediction_result = backend.predict(input_data)
         prediction = prediction_result.get("prediction", "No prediction")
     except Exception as e:
         return {'display': 'block'}, 'danger', html.Div([
@@ -562,6 +572,7 @@ def update_output(n_clicks, stored_values, mileage, power, engine_size, doors, s
     return {'display': 'none'}, '', '', html.Div([
         html.H4('Predicted Value', className='text-center mb-3'),
         html.P(html.B(prediction_text), className='text-center price-text mb-3'),
+        market_context(input_data, prediction),
         html.P('URL to find cars with these specifications on AutoScout24:', className='text-center mb-3'),
         html.A(html.B('Click here to go to Autoscout24.com'), href=search_url, target='_blank',
                className='d-block text-center alert-link mb-3'),
@@ -0,0 +1,189 @@
+import argparse
+import itertools
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dropdown_index import modified_at
+
+DIMENSIONS = ['brand', 'model', 'year', 'country']
+QUANTILES = {'q10': 0.1, 'q25': 0.25, 'median': 0.5, 'q75': 0.75, 'q90': 0.9}
+STATISTICS = ['count', 'mean', 'min', *QUANTILES, 'max']
+# Price categories of the statistical analysis notebook
+PRICE_BINS = [0, 2500, 5000, 10000, 15000, 20000, 25000, 30000, 35000, 40000, 45000, 50000, 60000, 80000, 100000,
+              200000, np.inf]
+PRICE_BIN_LABELS = ['0-2k5', '2k5-5k', '5k-10k', '10k-15k', '15k-20k', '20k-25k', '25k-30k', '30k-35k', '35k-40k',
+                    '40k-45k', '45k-50k', '50k-60k', '60k-80k', '80k-100k', '100k-200k', '200k+']
+# Listings from this price on are outliers, as in the notebook
+MAX_PRICE = 1_000_000
+# Cells of three or four dimensions with fewer listings are left out, queries fall back to coarser cells
+MIN_COUNT = 5
+
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ('brand', DICTIONARY),
+    ('model', DICTIONARY),
+    ('year', pa.int16()),
+    ('country', DICTIONARY),
+    ('count', pa.int32()),
+    *[(name, pa.float32()) for name in STATISTICS[1:]],
+    ('price_bins', pa.list_(pa.int32(), len(PRICE_BIN_LABELS))),
+])
+
+
+def read_listings(path):
+    # `path` is either the cleaned listings CSV or the brand/scrape_date partitioned Parquet dataset
+    columns = DIMENSIONS + ['price']
+    if os.path.isdir(path):
+        return ds.dataset(path, format='parquet', partitioning='hive').to_table(columns=columns).to_pandas()
+    return pd.read_csv(path, usecols=columns)
+
+
+def grouping_sets():
+    # Every combination of the dimensions, but a model only within its brand
+    for n in range(len(DIMENSIONS) + 1):
+        for dims in itertools.combinations(DIMENSIONS, n):
+            if 'model' not in dims or 'brand' in dims:
+                yield dims
+
+
+def build_cube(listings, max_price=MAX_PRICE, min_count=MIN_COUNT):
+    """
+    Price statistics of the listings for the combinations of the dimensions: one row for all listings, one per brand,
+    per brand and model, ..., per brand, model, year and country. A dimension left out of a row is null.
+    """
+    df = listings[DIMENSIONS + ['price']].dropna(subset=['price'])
+    df = df[df['price'] < max_price].copy()
+    df['year'] = df['year'].round().astype('Int16')
+    df['price_bin'] = pd.cut(df['price'], bins=PRICE_BINS, labels=False)
+    df['all'] = 0
+    frames = []
+    for dims in grouping_sets():
+        keys = list(dims) or ['all']
+        prices = df.groupby(keys, observed=True)['price']
+        cells = prices.agg(['count', 'mean', 'min', 'max'])
+        if len(dims) > 2:
+            cells = cells[cells['count'] >= min_count]
+        quantiles = prices.quantile(list(QUANTILES.values())).unstack()
+        cells[list(QUANTILES)] = quantiles.reindex(cells.index).to_numpy()
+        bins = df.groupby(keys + ['price_bin'], observed=True).size().unstack(fill_value=0)
+        bins = bins.reindex(index=cells.index, columns=range(len(PRICE_BIN_LABELS)), fill_value=0)
+        cells['price_bins'] = list(bins.to_numpy(dtype='int32'))
+        frames.append(cells.reset_index().drop(columns='all', errors='ignore'))
+    cube = pd.concat(frames, ignore_index=True)
+    return cube[SCHEMA.names]
+
+
+def to_table(cube):
+    arrays = []
+    for field in SCHEMA:
+        if field.name == 'price_bins':
+            values = pa.array(np.concatenate(cube['price_bins'].to_numpy()) if len(cube) else [], pa.int32())
+            arrays.append(pa.FixedSizeListArray.from_arrays(values, len(PRICE_BIN_LABELS)))
+        elif field.name == 'year':
+            arrays.append(pa.array(cube['year'], pa.int16(), from_pandas=True))
+        elif pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(cube[field.name].astype(object), pa.string(), from_pandas=True).dictionary_encode())
+        else:
+            arrays.append(pa.array(cube[field.name], field.type))
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def write_cube(cube, path):
+    tmp_path = f'{path}.tmp'
+    pq.write_table(to_table(cube), tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+class PriceCube:
+    """
+    Queries on the price statistics written by `build_cube`. Every set of dimensions has its own frame and a dict from
+    its values to their row, so a cell is found in microseconds and the cells of one brand in about a millisecond.
+    """
+
+    def __init__(self, cube):
+        self.levels = {}
+        self.cells = {}
+        present = cube[DIMENSIONS].notna().to_numpy()
+        for mask in np.unique(present, axis=0):
+            dims = tuple(dim for dim, keep in zip(DIMENSIONS, mask) if keep)
+            level = cube[(present == mask).all(axis=1)].drop(columns=[d for d in DIMENSIONS if d not in dims])
+            # Plain values rather than categories, so that breakdowns sort by value
+            for dim in dims:
+                level[dim] = level[dim].astype(int if dim == 'year' else str)
+            level = level.reset_index(drop=True)
+            self.levels[dims] = level
+            keys = zip(*(level[dim].tolist() for dim in dims)) if dims else [()]
+            self.cells[dims] = dict(zip(keys, range(len(level))))
+
+    @classmethod
+    def read(cls, path):
+        return cls(pq.read_table(path).to_pandas())
+
+    def cell(self, **filters):
+        """Statistics of the listings matching `filters` (any of brand, model, year and country), None without any."""
+        dims, key = self._key(filters)
+        row = self.cells.get(dims, {}).get(key)
+        if row is None:
+            return None
+        level = self.levels[dims]
+        return {name: level[name].iat[row] for name in STATISTICS + ['price_bins']}
+
+    def breakdown(self, by, **filters):
+        """Statistics per value of `by` among the listings matching `filters`, as a frame indexed by `by`."""
+        dims, key = self._key(filters)
+        if by not in DIMENSIONS or by in dims:
+            raise ValueError(f'Cannot break down by {by!r} with the filters {filters}')
+        level = self.levels[tuple(dim for dim in DIMENSIONS if dim in dims or dim == by)]
+        mask = np.ones(len(level), dtype=bool)
+        for dim, value in zip(dims, key):
+            mask &= (level[dim] == value).to_numpy()
+        return level[mask].set_index(by)[STATISTICS + ['price_bins']].sort_index()
+
+    def market_context(self, brand, model, year=None, country=None, min_count=20):
+        """
+        Statistics of the listings most like a car: of its brand, model, year and country, then leaving out the
+        country, the year and the model until at least `min_count` listings match. Returns the filters used and the
+        statistics, or None when even the brand has fewer listings.
+        """
+        for dims in [('brand', 'model', 'year', 'country'), ('brand', 'model', 'year'), ('brand', 'model'),
+                     ('brand',)]:
+            filters = {dim: value for dim, value in zip(DIMENSIONS, [brand, model, year, country]) if dim in dims}
+            if any(value is None for value in filters.values()):
+                continue
+            statistics = self.cell(**filters)
+            if statistics is not None and statistics['count'] >= min_count:
+                return filters, statistics
+        return None
+
+    @staticmethod
+    def _key(filters):
+        # The dimensions set in `filters`, in the order of DIMENSIONS, and their values
+        unknown = set(filters) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f'Unknown dimensions {sorted(unknown)}, expected some of {DIMENSIONS}')
+        dims = tuple(dim for dim in DIMENSIONS if filters.get(dim) is not None)
+        return dims, tuple(int(filters[dim]) if dim == 'year' else filters[dim] for dim in dims)
+
+
+def load_cube(cube_path, listings_path):
+    # The stored cube is used as long as it is newer than the listings, otherwise it is rebuilt once
+    if os.path.exists(cube_path) and (not os.path.exists(listings_path) or
+                                      os.path.getmtime(cube_path) >= modified_at(listings_path)):
+        return PriceCube.read(cube_path)
+    cube = build_cube(read_listings(listings_path))
+    try:
+        write_cube(cube, cube_path)
+    except OSError:
+        pass
+    return PriceCube(cube)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the price statistics cube from the cleaned listings')
+    parser.add_argument('listings_path', nargs='?', default='../data/cleaned_cars')
+    parser.add_argument('cube_path', nargs='?', default='../data/price_cube.parquet')
+    args = parser.parse_args()
+    write_cube(build_cube(read_listings(args.listings_path)), args.cube_path)
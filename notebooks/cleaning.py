@@ -0,0 +1,464 @@
+# Streaming version of data_cleaning.ipynb, for scrapes that do not fit in memory:
+#   python cleaning.py ../data/cars.csv ../data/cleaned_cars --chunk-size 200000
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+from itertools import repeat
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from data_store import coalesce, remove_listings, write_dataset
+from manifest import Manifest
+
+RAW_COLUMNS = ['url', 'brand', 'model', 'price', 'first_registration', 'mileage', 'fuel_type', 'color', 'gearbox',
+               'power', 'engine_size', 'seller', 'location', 'body_type', 'doors', 'seats', 'drivetrain',
+               'co2_emission', 'emission_class', 'condition', 'upholstery', 'upholstery_color']
+# Same columns, in the same order, as the notebook's cleaned_cars.csv
+CLEANED_COLUMNS = ['url', 'brand', 'model', 'price', 'mileage', 'fuel_type', 'color', 'gearbox', 'power',
+                   'engine_size', 'seller', 'body_type', 'doors', 'seats', 'drivetrain', 'emission_class', 'condition',
+                   'upholstery_color', 'year', 'country']
+LOWERCASE_COLUMNS = ['brand', 'model', 'fuel_type', 'color', 'seller', 'body_type', 'condition', 'upholstery',
+                     'upholstery_color']
+VALID_GEARBOX = ['automatic', 'manual', 'semi-automatic']
+VALID_DRIVETRAIN = ['front', 'rear', '4wd']
+VALID_DOORS = ['2', '3', '4', '5']
+VALID_SEATS = ['2', '4', '5', '7']
+INVALID_COUNTRIES = ['schwab', 'westfalen', 'nan', '', 'altenerding']
+MAX_PRICE = 100000
+# Numbers parsed by the scraper's ParquetPipeline are stored next to their text as `<column>_value`
+VALUE_SUFFIX = '_value'
+
+
+def parse_number(values, pattern):
+    # Drops every match of `pattern` and reads what is left as a number, anything unreadable becomes NaN
+    return pd.to_numeric(values.str.replace(pattern, '', regex=True), errors='coerce')
+
+
+def parsed(raw, column, parse):
+    # The number the scraper already parsed when there is one, otherwise `parse` of the text
+    value = column + VALUE_SUFFIX
+    return raw[value].astype(float) if value in raw else parse(raw[column])
+
+
+def parse_chunk(raw):
+    """Row by row part of the notebook: parses the raw text fields and drops the listings without a valid country."""
+    df = pd.DataFrame(index=raw.index)
+    df['url'] = raw['url']
+    for column in LOWERCASE_COLUMNS:
+        df[column] = raw[column].str.lower().replace('unknown', np.nan)
+    # '1.234,-' and '12,345' both mean a whole number of euros
+    df['price'] = parsed(raw, 'price', lambda values: parse_number(values, r'[€.,\-]'))
+    df['mileage'] = parsed(raw, 'mileage', lambda values: parse_number(values, r' km|[, ]'))
+    gearbox = raw['gearbox'].str.lower()
+    df['gearbox'] = gearbox.where(gearbox.isin(VALID_GEARBOX))
+    # '110 kW (150 hp)' keeps the horsepower
+    df['power'] = parsed(raw, 'power', lambda values: parse_number(
+        values.str.extract(r'^[^(]*\(([^(]*)', expand=False), r' hp\)| kW\)|[ ,]'))
+    df['engine_size'] = parsed(raw, 'engine_size', lambda values: parse_number(
+        values.where(values.str.contains('cc', na=False)), r' cc|,'))
+    df['body_type'] = df['body_type'].replace('off-road/pick-up', 'off-road-pick-up')
+    df['doors'] = raw['doors'].where(raw['doors'].isin(VALID_DOORS)).astype(float)
+    df['seats'] = raw['seats'].where(raw['seats'].isin(VALID_SEATS)).astype(float)
+    drivetrain = raw['drivetrain'].str.lower()
+    df['drivetrain'] = drivetrain.where(drivetrain.isin(VALID_DRIVETRAIN))
+    df['emission_class'] = parsed(raw, 'emission_class', lambda values: parse_number(
+        values.where(values.str.contains('g/km', na=False)), r'g/km|,|\(comb\.?\)| '))
+    df['upholstery_color'] = df['upholstery_color'].replace('others', np.nan)
+    df['year'] = parsed(raw, 'first_registration',
+                        lambda values: values.str.extract(r'(\d{4})', expand=False).astype(float))
+    country = raw['location'].str.split(',').str[1].str.replace(' ', '').str.lower().replace('unknown', np.nan)
+    df['country'] = country
+    return df[country.notna() & ~country.isin(INVALID_COUNTRIES)]
+
+
+def mode(counts):
+    # pandas' `mode()[0]`: the smallest of the most frequent values
+    if not counts:
+        return np.nan
+    top = max(counts.values())
+    return min(value for value, count in counts.items() if count == top)
+
+
+def unique_mode(counts):
+    # `agg(pd.Series.mode)` gives an array when several values tie, which the notebook then coerces to NaN
+    if not counts:
+        return np.nan
+    top = max(counts.values())
+    modes = [value for value, count in counts.items() if count == top]
+    return modes[0] if len(modes) == 1 else np.nan
+
+
+def median(counts):
+    n = sum(counts.values())
+    if not n:
+        return np.nan
+    middle, seen, lower = (n - 1) // 2, 0, None
+    for value in sorted(counts):
+        seen += counts[value]
+        if lower is None and seen > middle:
+            lower = value
+        if seen > n // 2:
+            return (lower + value) / 2
+
+
+def mean(counts):
+    n = sum(counts.values())
+    return sum(value * count for value, count in counts.items()) / n if n else np.nan
+
+
+def count_values(counter, values):
+    counter.update(values.value_counts().to_dict())
+
+
+def count_groups(groups, df, by, column):
+    for (key, value), count in df.groupby([by, column]).size().items():
+        groups[key][value] += count
+
+
+def fill_from(values, keys, mapping):
+    return values.fillna(keys.map(mapping))
+
+
+class Statistics:
+    """
+    Everything the notebook computes over the whole dataset, gathered from value counts so each pass only holds one
+    chunk. The notebook computes them at different steps, on the rows left at that step.
+    """
+
+    def __init__(self):
+        self.models = defaultdict(Counter)
+        self.mileage = Counter()
+        self.fuel_type = Counter()
+        self.color = Counter()
+        # Rows with a valid gearbox
+        self.power = defaultdict(Counter)
+        self.engine_size = defaultdict(Counter)
+        self.brand_power = defaultdict(Counter)
+        self.brand_engine_size = defaultdict(Counter)
+        self.missing_power = defaultdict(Counter)
+        self.missing_engine_size = defaultdict(Counter)
+        self.doors = defaultdict(Counter)
+        self.seats = defaultdict(Counter)
+        self.all_seats = Counter()
+        self.missing_seats = Counter()
+        # Rows with a valid gearbox and drivetrain
+        self.emission_class = defaultdict(Counter)
+        self.brand_emission_class = defaultdict(Counter)
+        self.missing_emission_class = defaultdict(Counter)
+        self.year = defaultdict(Counter)
+        self.brand_year = defaultdict(Counter)
+        self.missing_year = defaultdict(Counter)
+        self.upholstery_color = defaultdict(Counter)
+        self.all_doors = Counter()
+        self.missing_doors = Counter()
+
+    def first_pass(self, df):
+        count_groups(self.models, df, 'brand', 'model')
+        count_values(self.mileage, df['mileage'])
+        count_values(self.fuel_type, df['fuel_type'])
+        count_values(self.color, df['color'])
+
+    def finish_first_pass(self):
+        self.model_fill = {brand: mode(counts) for brand, counts in self.models.items()}
+        self.mileage_fill = median(self.mileage)
+        self.fuel_type_fill = mode(self.fuel_type)
+        self.color_fill = mode(self.color)
+
+    def fill_first(self, df):
+        df['model'] = fill_from(df['model'], df['brand'], self.model_fill)
+        df['mileage'] = df['mileage'].fillna(self.mileage_fill)
+        df['fuel_type'] = df['fuel_type'].fillna(self.fuel_type_fill)
+        df['color'] = df['color'].fillna(self.color_fill)
+        return df[df['gearbox'].isin(VALID_GEARBOX)].copy()
+
+    def second_pass(self, df):
+        df = self.fill_first(df)
+        for column, by_model, by_brand, missing in [
+                ('power', self.power, self.brand_power, self.missing_power),
+                ('engine_size', self.engine_size, self.brand_engine_size, self.missing_engine_size)]:
+            count_groups(by_model, df, 'model', column)
+            count_groups(by_brand, df, 'brand', column)
+            count_groups(missing, df[df[column].isna()], 'brand', 'model')
+        count_groups(self.doors, df, 'brand', 'doors')
+        count_groups(self.seats, df, 'model', 'seats')
+        count_values(self.all_seats, df['seats'])
+        count_values(self.missing_seats, df.loc[df['seats'].isna(), 'model'].fillna('\0'))
+
+        df = df[df['drivetrain'].isin(VALID_DRIVETRAIN)]
+        for column, by_model, by_brand, missing in [
+                ('emission_class', self.emission_class, self.brand_emission_class, self.missing_emission_class),
+                ('year', self.year, self.brand_year, self.missing_year)]:
+            count_groups(by_model, df, 'model', column)
+            count_groups(by_brand, df, 'brand', column)
+            count_groups(missing, df[df[column].isna()], 'brand', 'model')
+        count_groups(self.upholstery_color, df, 'brand', 'upholstery_color')
+        count_values(self.all_doors, df['doors'])
+        count_values(self.missing_doors, df.loc[df['doors'].isna(), 'brand'].fillna('\0'))
+
+    def finish_second_pass(self):
+        self.power_fill, self.brand_power_fill = self._two_level(
+            self.power, self.brand_power, self.missing_power, median, median)
+        self.engine_size_fill, self.brand_engine_size_fill = self._two_level(
+            self.engine_size, self.brand_engine_size, self.missing_engine_size, median, median)
+        self.emission_class_fill, self.brand_emission_class_fill = self._two_level(
+            self.emission_class, self.brand_emission_class, self.missing_emission_class, mean, mode)
+        self.year_fill, self.brand_year_fill = self._two_level(
+            self.year, self.brand_year, self.missing_year, median, median)
+        self.doors_fill = {brand: mode(counts) for brand, counts in self.doors.items()}
+        self.seats_fill = {model: unique_mode(counts) for model, counts in self.seats.items()}
+        self.upholstery_color_fill = {brand: mode(counts) for brand, counts in self.upholstery_color.items()}
+        # The final seats and doors fallbacks are the modes after the per-model and per-brand fills
+        seats = Counter(self.all_seats)
+        for model, count in self.missing_seats.items():
+            value = self.seats_fill.get(model, np.nan)
+            if not pd.isna(value):
+                seats[value] += count
+        self.all_seats_fill = mode(seats)
+        doors = Counter(self.all_doors)
+        for brand, count in self.missing_doors.items():
+            value = self.doors_fill.get(brand, np.nan)
+            if not pd.isna(value):
+                doors[value] += count
+        self.all_doors_fill = mode(doors)
+
+    @staticmethod
+    def _two_level(by_model, by_brand, missing, model_statistic, brand_statistic):
+        # The brand fallback is computed once the model level values are filled in
+        model_fill = {model: model_statistic(counts) for model, counts in by_model.items()}
+        brand_fill = {}
+        for brand in by_brand.keys() | missing.keys():
+            values = Counter(by_brand.get(brand, {}))
+            for model, count in missing.get(brand, {}).items():
+                value = model_fill.get(model, np.nan)
+                if not pd.isna(value):
+                    values[value] += count
+            brand_fill[brand] = brand_statistic(values)
+        return model_fill, brand_fill
+
+    def fill(self, df):
+        df = self.fill_first(df)
+        for column in ['power', 'engine_size']:
+            df[column] = fill_from(df[column], df['model'], getattr(self, f'{column}_fill'))
+            df[column] = fill_from(df[column], df['brand'], getattr(self, f'brand_{column}_fill'))
+        df['doors'] = fill_from(df['doors'], df['brand'], self.doors_fill)
+        df['seats'] = fill_from(df['seats'], df['model'], self.seats_fill).fillna(self.all_seats_fill).astype(int)
+        df = df[df['drivetrain'].isin(VALID_DRIVETRAIN)].copy()
+        for column in ['emission_class', 'year']:
+            df[column] = fill_from(df[column], df['model'], getattr(self, f'{column}_fill'))
+            df[column] = fill_from(df[column], df['brand'], getattr(self, f'brand_{column}_fill'))
+        df['upholstery_color'] = fill_from(df['upholstery_color'], df['brand'], self.upholstery_color_fill)
+        df['doors'] = df['doors'].fillna(self.all_doors_fill).astype(int)
+        df = df[CLEANED_COLUMNS]
+        for column in df.columns:
+            if df[column].dtype == object:
+                # The notebook turns the text columns into str, missing values included
+                df[column] = df[column].astype(str).where(df[column].notna(), 'nan')
+        return df[df['price'] < MAX_PRICE]
+
+
+def read_raw(path, chunk_size):
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        return read_raw_parquet(path, chunk_size)
+    # Everything is read as text, chunks would otherwise infer different dtypes for the same column
+    return pd.read_csv(path, usecols=RAW_COLUMNS, dtype=str, chunksize=chunk_size)
+
+
+def read_raw_parquet(path, chunk_size):
+    # Scrape written by the scraper's ParquetPipeline, a file or a directory of them: the same text columns as the
+    # CSV, plus the numbers parsed while scraping
+    dataset = ds.dataset(path, format='parquet')
+    columns = RAW_COLUMNS + [name for name in dataset.schema.names if name.endswith(VALUE_SUFFIX)]
+    start = 0
+    for raw in coalesce(dataset.to_batches(columns=columns, batch_size=chunk_size), chunk_size):
+        # Numbered across chunks and with empty text missing, like the chunks of read_csv
+        raw.index = pd.RangeIndex(start, start + len(raw))
+        start += len(raw)
+        raw[RAW_COLUMNS] = raw[RAW_COLUMNS].replace('', np.nan)
+        yield raw
+
+
+def read_spill(spill_dir):
+    for name in sorted(os.listdir(spill_dir)):
+        yield pd.read_parquet(os.path.join(spill_dir, name))
+
+
+def content_hash(raw):
+    return pd.util.hash_pandas_object(raw[RAW_COLUMNS], index=False).to_numpy().view(np.int64)
+
+
+def remove_file(path):
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def clean(raw_path, output, chunk_size=200_000, scrape_date=None, manifest_path=None):
+    """
+    Cleans the raw scrape the same way as data_cleaning.ipynb, holding one chunk of `chunk_size` rows at a time.
+    The first pass parses the chunks into a temporary spill, the second one gathers the statistics used to impute
+    missing values and the third one writes the cleaned rows to `output`, a CSV file or a Parquet dataset.
+    With `manifest_path`, the manifest used by `clean_incremental` is rebuilt along with the dataset.
+    """
+    scrape_date = str(scrape_date or datetime.date.today())
+    statistics = Statistics()
+    manifest = None
+    if manifest_path:
+        remove_file(f'{manifest_path}.tmp')
+        manifest = Manifest(f'{manifest_path}.tmp')
+    with tempfile.TemporaryDirectory() as spill_dir:
+        for i, raw in enumerate(read_raw(raw_path, chunk_size)):
+            if manifest:
+                manifest.upsert(zip(raw['url'], content_hash(raw).tolist(), repeat(None), repeat(None)))
+            df = parse_chunk(raw)
+            statistics.first_pass(df)
+            df.to_parquet(os.path.join(spill_dir, f'{i:06d}.parquet'))
+        statistics.finish_first_pass()
+        for df in read_spill(spill_dir):
+            statistics.second_pass(df)
+        statistics.finish_second_pass()
+        chunks = (statistics.fill(df) for df in read_spill(spill_dir))
+        if manifest:
+            chunks = placed(chunks, manifest, scrape_date)
+        write_output(chunks, output, scrape_date)
+    if manifest:
+        manifest.save_state('statistics', statistics)
+        manifest.commit()
+        manifest.close()
+        remove_file(manifest_path)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+    return statistics
+
+
+def placed(chunks, manifest, scrape_date):
+    for df in chunks:
+        manifest.place(zip(df['url'], df['brand'], repeat(scrape_date)))
+        yield df
+
+
+def write_output(chunks, output, scrape_date=None):
+    # Written next to `output` and swapped in at the end, so readers never see a half written dataset
+    tmp_output = f'{output}.tmp'
+    if output.endswith('.csv'):
+        for i, df in enumerate(chunks):
+            df.to_csv(tmp_output, index=False, header=i == 0, mode='w' if i == 0 else 'a')
+        os.replace(tmp_output, output)
+        return
+    shutil.rmtree(tmp_output, ignore_errors=True)
+    for df in chunks:
+        write_dataset(df, tmp_output, scrape_date, replace=False)
+    shutil.rmtree(output, ignore_errors=True)
+    os.replace(tmp_output, output)
+
+
+def finish_removals(manifest, output):
+    # Removals journaled by an incremental run that stopped before detaching them from the manifest
+    pending = manifest.load_state('pending_removals')
+    if pending:
+        remove_listings(output, pending)
+        manifest.detach(url for urls in pending.values() for url in urls)
+        manifest.save_state('pending_removals', None)
+        manifest.commit()
+
+
+def clean_incremental(raw_path, output, manifest_path, chunk_size=200_000, scrape_date=None, snapshot=False):
+    """
+    Cleans only the listings of the raw scrape that are new or whose raw fields changed since they were cleaned, and
+    merges them into the Parquet dataset at `output`. Their previous version is removed from the partition holding
+    it. With `snapshot`, the scrape is taken as the complete list of live listings and the ones missing from it are
+    tombstoned and removed from the dataset.
+
+    Missing values are imputed with the statistics of the last full `clean`, so a full clean from time to time
+    keeps them in line with the data.
+    """
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f'{manifest_path} does not exist, run a full clean first')
+    scrape_date = str(scrape_date or datetime.date.today())
+    with Manifest(manifest_path) as manifest, tempfile.TemporaryDirectory() as spill_dir:
+        statistics = manifest.load_state('statistics')
+        if statistics is None:
+            raise ValueError(f'{manifest_path} has no cleaning statistics, run a full clean first')
+        finish_removals(manifest, output)
+        summary = Counter()
+        removals = defaultdict(set)
+        for i, raw in enumerate(read_raw(raw_path, chunk_size)):
+            raw = raw.drop_duplicates('url', keep='last')
+            if snapshot:
+                manifest.mark_seen(raw['url'])
+            raw['content_hash'] = content_hash(raw)
+            known = manifest.lookup(raw['url'])
+            changed = []
+            for url, new_hash in zip(raw['url'], raw['content_hash']):
+                entry = known.get(url)
+                if entry is not None and entry[0] == new_hash and entry[3] is None:
+                    summary['unchanged'] += 1
+                    continue
+                summary['changed' if entry is not None else 'new'] += 1
+                changed.append(url)
+                if entry is not None and entry[1] is not None:
+                    removals[entry[1], entry[2]].add(url)
+            raw[raw['url'].isin(changed)].to_parquet(os.path.join(spill_dir, f'{i:06d}.parquet'))
+
+        if snapshot:
+            removed = manifest.unseen()
+            for url, brand, date in removed:
+                if brand is not None:
+                    removals[brand, date].add(url)
+            summary['removed'] = len(removed)
+
+        # Journaled before the dataset is touched, so that the next run finishes the removal if this one stops
+        # before the manifest is updated. Detached listings are cleaned again by the next run.
+        manifest.save_state('pending_removals', dict(removals))
+        manifest.commit()
+        remove_listings(output, removals)
+        manifest.detach(url for urls in removals.values() for url in urls)
+        if snapshot:
+            manifest.tombstone((url for url, _, _ in removed), scrape_date)
+        manifest.save_state('pending_removals', None)
+        manifest.commit()
+
+        # A listing changed in several chunks keeps its last version
+        changed = pd.concat([pd.DataFrame(columns=RAW_COLUMNS + ['content_hash']), *read_spill(spill_dir)],
+                            ignore_index=True).drop_duplicates('url', keep='last')
+        for start in range(0, len(changed), chunk_size):
+            raw = changed.iloc[start:start + chunk_size]
+            manifest.upsert(zip(raw['url'], raw['content_hash'].tolist(), repeat(None), repeat(None)))
+            df = statistics.fill(parse_chunk(raw))
+            if len(df):
+                write_dataset(df, output, scrape_date, replace=False)
+                manifest.place(zip(df['url'], df['brand'], repeat(scrape_date)))
+            manifest.commit()
+    return dict(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Clean the raw scrape in bounded memory')
+    parser.add_argument('raw_path', nargs='?', default='../data/cars.csv',
+                        help="the scraper's CSV feed or its Parquet output")
+    parser.add_argument('output', nargs='?', default='../data/cleaned_cars',
+                        help='Parquet dataset directory, or a .csv file')
+    parser.add_argument('--chunk-size', type=int, default=200_000)
+    parser.add_argument('--scrape-date', default=None, help='defaults to today')
+    parser.add_argument('--manifest', default=None, help='defaults to <output>.manifest.sqlite for a Parquet output')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only clean the new and changed listings and merge them into the existing dataset')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='with --incremental, remove the listings missing from the raw scrape')
+    args = parser.parse_args()
+
+    manifest_path = args.manifest
+    if manifest_path is None and not args.output.endswith('.csv'):
+        manifest_path = f'{args.output}.manifest.sqlite'
+    if args.incremental:
+        if args.output.endswith('.csv') or manifest_path is None:
+            parser.error('--incremental needs a Parquet dataset output')
+        print(clean_incremental(args.raw_path, args.output, manifest_path, args.chunk_size, args.scrape_date,
+                                args.snapshot))
+    else:
+        clean(args.raw_path, args.output, args.chunk_size, args.scrape_date, manifest_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# Typed, partitioned Parquet store for the cleaned listings, replacing cleaned_cars.csv.
+#   python data_store.py convert ../data/cleaned_cars.csv ../data/cleaned_cars --scrape-date 2025-03-01
+#   python data_store.py compare ../data/cleaned_cars.csv ../data/cleaned_cars
+import argparse
+import datetime
+import glob
+import os
+import shutil
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+PARTITION_COLUMNS = ['brand', 'scrape_date']
+CATEGORICAL_COLUMNS = ['brand', 'model', 'fuel_type', 'gearbox', 'color', 'seller', 'body_type', 'drivetrain',
+                       'country', 'condition', 'upholstery_color']
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+# Column order of cleaned_cars.csv, the feature order of the model depends on it
+SCHEMA = pa.schema([
+    ('url', pa.string()),
+    ('brand', DICTIONARY),
+    ('model', DICTIONARY),
+    ('price', pa.float64()),
+    ('mileage', pa.float64()),
+    ('fuel_type', DICTIONARY),
+    ('color', DICTIONARY),
+    ('gearbox', DICTIONARY),
+    ('power', pa.float64()),
+    ('engine_size', pa.float64()),
+    ('seller', DICTIONARY),
+    ('body_type', DICTIONARY),
+    ('doors', pa.int64()),
+    ('seats', pa.int64()),
+    ('drivetrain', DICTIONARY),
+    ('emission_class', pa.float64()),
+    ('condition', DICTIONARY),
+    ('upholstery_color', DICTIONARY),
+    ('year', pa.float64()),
+    ('country', DICTIONARY),
+    ('scrape_date', pa.string()),
+])
+COLUMNS = [name for name in SCHEMA.names if name != 'scrape_date']
+PARTITIONING = ds.partitioning(pa.schema([('brand', pa.string()), ('scrape_date', pa.string())]), flavor='hive')
+
+
+def to_table(df, scrape_date=None):
+    df = df.copy()
+    if 'scrape_date' not in df.columns:
+        df['scrape_date'] = str(scrape_date or datetime.date.today())
+    schema = pa.schema([field for field in SCHEMA if field.name in df.columns])
+    return pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+
+def write_dataset(df, root, scrape_date=None, replace=True):
+    """
+    Writes cleaned listings under `root/brand=<brand>/scrape_date=<date>/`. With `replace`, the partitions present in
+    `df` are rewritten and the others are kept, otherwise the rows are added as new files next to the existing ones.
+    """
+    ds.write_dataset(to_table(df, scrape_date), root, format='parquet', partitioning=PARTITIONING,
+                     basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                     existing_data_behavior='delete_matching' if replace else 'overwrite_or_ignore')
+
+
+def partition_path(root, brand, scrape_date):
+    directory, _ = PARTITIONING.format((ds.field('brand') == brand) & (ds.field('scrape_date') == scrape_date))
+    return os.path.join(root, directory)
+
+
+def remove_listings(root, urls_by_partition):
+    # Rewrites each (brand, scrape_date) partition without the given URLs, only the listed partitions are read. The
+    # rows kept are written before the old files are deleted, a removal stopped in between is finished by running it
+    # again, which also drops the rows it left twice.
+    for (brand, scrape_date), urls in urls_by_partition.items():
+        directory = partition_path(root, brand, scrape_date)
+        old_files = glob.glob(os.path.join(directory, '*.parquet'))
+        if not old_files:
+            continue
+        df = read_dataset(root, brands=[brand], since=scrape_date, until=scrape_date, categorical=False)
+        keep = df[~df['url'].isin(urls)].drop_duplicates('url', keep='last')
+        if len(keep) == len(df):
+            continue
+        if len(keep):
+            write_dataset(keep, root, scrape_date, replace=False)
+        for path in old_files:
+            os.remove(path)
+        if keep.empty:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def open_dataset(root):
+    # Partition values are read back as plain strings, they are turned into categoricals with the other columns
+    schema = pa.schema([pa.field(field.name, pa.string()) if field.name in PARTITION_COLUMNS else field
+                        for field in SCHEMA])
+    return ds.dataset(root, format='parquet', partitioning=PARTITIONING, schema=schema)
+
+
+def partition_filter(brands=None, since=None, until=None):
+    expression = None
+    conditions = []
+    if brands is not None:
+        conditions.append(ds.field('brand').isin(list(brands)))
+    if since is not None:
+        conditions.append(ds.field('scrape_date') >= str(since))
+    if until is not None:
+        conditions.append(ds.field('scrape_date') <= str(until))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_dataset(root, columns=None, brands=None, since=None, until=None, categorical=True):
+    """
+    Loads the requested columns of the partitions matching `brands` and the scrape date range. Only those files and
+    columns are read. Categorical columns come back with sorted categories, so one-hot encoding them gives the same
+    columns in the same order as encoding the CSV did.
+    """
+    columns = list(columns or COLUMNS)
+    table = open_dataset(root).to_table(columns=columns, filter=partition_filter(brands, since, until))
+    df = table.to_pandas()
+    for column in df.columns:
+        if column not in CATEGORICAL_COLUMNS:
+            continue
+        if categorical:
+            values = df[column].astype('category').cat.remove_unused_categories()
+            df[column] = values.cat.reorder_categories(sorted(values.cat.categories))
+        else:
+            df[column] = df[column].astype(object)
+    return df[columns]
+
+
+def coalesce(batches, batch_size):
+    # Combines small record batches into DataFrames of at most `batch_size` rows, so that the per-frame cost is paid
+    # once per `batch_size` rows
+    pending, rows = [], 0
+    for batch in batches:
+        if pending and rows + batch.num_rows > batch_size:
+            yield pa.Table.from_batches(pending).to_pandas()
+            pending, rows = [], 0
+        if batch.num_rows:
+            pending.append(batch)
+            rows += batch.num_rows
+    if pending:
+        yield pa.Table.from_batches(pending).to_pandas()
+
+
+def iter_batches(root, columns=None, brands=None, since=None, until=None, batch_size=100_000):
+    # Streams the dataset as DataFrames of at most `batch_size` rows, the scanner gives one or more record batches per
+    # file
+    scanner = open_dataset(root).scanner(columns=list(columns or COLUMNS),
+                                         filter=partition_filter(brands, since, until), batch_size=batch_size)
+    return coalesce(scanner.to_batches(), batch_size)
+
+
+def measure(load):
+    started = time.perf_counter()
+    df = load()
+    return time.perf_counter() - started, df.memory_usage(deep=True).sum(), len(df)
+
+
+def compare(csv_path, root, columns, brands):
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+    print(f'CSV: {os.path.getsize(csv_path) / 1e6:.1f} MB on disk, Parquet: {size / 1e6:.1f} MB on disk')
+    loads = [
+        ('csv, all columns', lambda: pd.read_csv(csv_path)),
+        ('parquet, all columns', lambda: read_dataset(root)),
+        (f'csv, {len(columns)} columns', lambda: pd.read_csv(csv_path, usecols=columns)),
+        (f'parquet, {len(columns)} columns', lambda: read_dataset(root, columns)),
+        (f'csv, {len(brands)} brands', lambda: (lambda df: df[df['brand'].isin(brands)])(pd.read_csv(csv_path))),
+        (f'parquet, {len(brands)} brands', lambda: read_dataset(root, brands=brands)),
+    ]
+    print(f'{"load":>24} {"rows":>10} {"seconds":>9} {"memory MB":>10}')
+    for name, load in loads:
+        seconds, memory, rows = measure(load)
+        print(f'{name:>24} {rows:>10} {seconds:>9.3f} {memory / 1e6:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert cleaned_cars.csv to the Parquet store or compare both')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert')
+    convert_parser.add_argument('csv_path')
+    convert_parser.add_argument('root')
+    convert_parser.add_argument('--scrape-date', default=None, help='defaults to today')
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('csv_path')
+    compare_parser.add_argument('root')
+    compare_parser.add_argument('--columns', nargs='+', default=['brand', 'model', 'fuel_type', 'gearbox'])
+    compare_parser.add_argument('--brands', nargs='+', default=['audi', 'bmw'])
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        write_dataset(pd.read_csv(args.csv_path), args.root, args.scrape_date)
+    else:
+        compare(args.csv_path, args.root, args.columns, args.brands)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import pickle
+import sqlite3
+
+# SQLite limits the number of parameters of a single statement
+BATCH_SIZE = 900
+
+
+class Manifest:
+    """
+    Records, for every listing URL cleaned so far, the hash of its raw fields (`content_hash`) and the `brand` and
+    `scrape_date` of the dataset partition holding it. `brand` and `scrape_date` are NULL when the listing was
+    filtered out during cleaning or detached to be cleaned again, `content_hash` is NULL too for a detached listing.
+    `removed_at` is set once the listing disappeared from the scrape. The `state` table keeps the cleaning statistics
+    and the removals of an unfinished incremental run.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS listings (
+                url TEXT PRIMARY KEY,
+                content_hash INTEGER,
+                brand TEXT,
+                scrape_date TEXT,
+                removed_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB);
+            CREATE TEMP TABLE seen (url TEXT PRIMARY KEY);
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def commit(self):
+        self.connection.commit()
+
+    def lookup(self, urls):
+        # url -> (content_hash, brand, scrape_date, removed_at)
+        urls = list(urls)
+        found = {}
+        for start in range(0, len(urls), BATCH_SIZE):
+            batch = urls[start:start + BATCH_SIZE]
+            rows = self.connection.execute(
+                f'SELECT url, content_hash, brand, scrape_date, removed_at FROM listings '
+                f'WHERE url IN ({",".join("?" * len(batch))})', batch)
+            found.update((row[0], row[1:]) for row in rows)
+        return found
+
+    def upsert(self, rows):
+        # rows of (url, content_hash, brand, scrape_date), which also revive a removed listing
+        self.connection.executemany('''
+            INSERT INTO listings (url, content_hash, brand, scrape_date, removed_at) VALUES (?, ?, ?, ?, NULL)
+            ON CONFLICT (url) DO UPDATE SET content_hash = excluded.content_hash, brand = excluded.brand,
+                scrape_date = excluded.scrape_date, removed_at = NULL
+        ''', rows)
+
+    def place(self, rows):
+        # rows of (url, brand, scrape_date) for listings written to the dataset
+        self.connection.executemany('UPDATE listings SET brand = ?, scrape_date = ? WHERE url = ?',
+                                    ((brand, scrape_date, url) for url, brand, scrape_date in rows))
+
+    def detach(self, urls):
+        # The listings are no longer in the dataset and will be cleaned again on the next run
+        self.connection.executemany('UPDATE listings SET content_hash = NULL, brand = NULL, scrape_date = NULL '
+                                    'WHERE url = ?', ((url,) for url in urls))
+
+    def mark_seen(self, urls):
+        self.connection.executemany('INSERT OR IGNORE INTO seen (url) VALUES (?)', ((url,) for url in urls))
+
+    def unseen(self):
+        # Listings still live in the manifest but absent from the scrape being processed
+        return self.connection.execute('''
+            SELECT url, brand, scrape_date FROM listings
+            WHERE removed_at IS NULL AND url NOT IN (SELECT url FROM seen)
+        ''').fetchall()
+
+    def tombstone(self, urls, removed_at):
+        self.connection.executemany('UPDATE listings SET brand = NULL, scrape_date = NULL, removed_at = ? '
+                                    'WHERE url = ?', ((removed_at, url) for url in urls))
+
+    def counts(self):
+        return dict(self.connection.execute('''
+            SELECT CASE WHEN removed_at IS NOT NULL THEN 'removed' WHEN brand IS NULL THEN 'filtered'
+                   ELSE 'active' END, COUNT(*)
+            FROM listings GROUP BY 1
+        ''').fetchall())
+
+    def save_state(self, key, value):
+        self.connection.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                                (key, pickle.dumps(value)))
+
+    def load_state(self, key):
+        row = self.connection.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return pickle.loads(row[0]) if row else None
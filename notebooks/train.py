@@ -0,0 +1,162 @@
+# Parallel, resumable hyperparameter search for the price model, replacing the notebook's GridSearchCV:
+#   python train.py ../data/cleaned_cars --trials 81 --workers 4 --checkpoint search.jsonl
+# Rerunning the same command after an interruption skips the trials already in the checkpoint.
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import numpy as np
+import xgboost as xgb
+from training_data import StageReport, TrainingData, load_training_data
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+from app.export_model import export_native  # noqa: E402
+from app.inference import densify_one_hot_splits  # noqa: E402
+
+# Same search space as the notebook's grid
+PARAM_GRID = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [3, 6, 9],
+    'learning_rate': [0.1, 0.2, 0.3],
+    'colsample_bytree': [0.6, 0.8, 1],
+    'subsample': [0.6, 0.8, 1],
+    'gamma': [0, 1, 5],
+}
+BEST_HYPERPARAMETERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'best_hyperparameters.txt')
+SEED = 42
+
+# Filled in each worker process by load_worker
+_data = {}
+
+
+def load_worker(directory, nthread):
+    # Runs once per worker, every trial of that worker reuses the memory mapped matrices and the validation DMatrix
+    data = TrainingData.load(directory)
+    X_val, y_val = data.split('val')
+    _data.update(data=data, nthread=nthread, dval=xgb.DMatrix(X_val, label=y_val, nthread=nthread))
+
+
+def booster_params(params, nthread):
+    booster = {key: value for key, value in params.items() if key != 'n_estimators'}
+    return {**booster, 'objective': 'reg:squarederror', 'tree_method': 'hist', 'seed': SEED, 'nthread': nthread}
+
+
+def fit(X, y, params, nthread):
+    # Absent one-hot entries of the CSR matrix are missing values to XGBoost, not zeros
+    dtrain = xgb.DMatrix(X, label=y, nthread=nthread)
+    return xgb.train(booster_params(params, nthread), dtrain, num_boost_round=params['n_estimators'])
+
+
+def run_trial(params, n_rows):
+    started = time.perf_counter()
+    booster = fit(*_data['data'].split('train', n_rows), params, _data['nthread'])
+    predictions = booster.predict(_data['dval'])
+    rmse = float(np.sqrt(np.mean((predictions - _data['dval'].get_label()) ** 2)))
+    return rmse, time.perf_counter() - started
+
+
+def sample_configs(n_trials, seed=SEED):
+    # Random search without replacement over the grid, the same seed gives the same trials on resume
+    configs = [dict(zip(PARAM_GRID, values)) for values in product(*PARAM_GRID.values())]
+    return random.Random(seed).sample(configs, min(n_trials, len(configs)))
+
+
+def trial_key(params, n_rows):
+    return json.dumps(params, sort_keys=True), n_rows
+
+
+def load_checkpoint(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    trial = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut short by an interruption, the trial runs again
+                    continue
+                done[trial_key(trial['params'], trial['rows'])] = trial['rmse']
+    return done
+
+
+def search(feature_dir, configs, n_train, checkpoint, workers, rungs=3, eta=3):
+    """
+    Successive halving: every config is trained on 1 / eta ** (rungs - 1) of the training rows, the best 1 / eta of
+    them move on to eta times more rows, until the last rung uses all of them. Configs are ranked by validation RMSE.
+    Each finished trial is appended to `checkpoint` and skipped when the search is run again.
+    """
+    done = load_checkpoint(checkpoint)
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+    candidates = configs
+    with ProcessPoolExecutor(workers, initializer=load_worker, initargs=(feature_dir, nthread)) as pool, \
+            open(checkpoint, 'a') as log:
+        for rung in range(rungs):
+            n_rows = max(1, n_train // eta ** (rungs - 1 - rung))
+            futures = {pool.submit(run_trial, params, n_rows): params for params in candidates
+                       if trial_key(params, n_rows) not in done}
+            print(f'Rung {rung}: {len(candidates)} configs on {n_rows} rows, {len(futures)} to run')
+            for future in as_completed(futures):
+                params = futures[future]
+                rmse, seconds = future.result()
+                done[trial_key(params, n_rows)] = rmse
+                log.write(json.dumps({'params': params, 'rows': n_rows, 'rmse': rmse, 'seconds': seconds}) + '\n')
+                log.flush()
+                print(f'  rmse {rmse:10.2f} in {seconds:6.1f}s {params}')
+            candidates = sorted(candidates, key=lambda params: done[trial_key(params, n_rows)])
+            if rung < rungs - 1:
+                candidates = candidates[:max(1, math.ceil(len(candidates) / eta))]
+    return candidates[0], done[trial_key(candidates[0], n_rows)]
+
+
+def write_best(params, path=BEST_HYPERPARAMETERS_PATH):
+    with open(path, 'w') as f:
+        f.write(str(dict(sorted(params.items()))))
+
+
+def export(data, params, model_dir):
+    transformer = data.transformer
+    booster = fit(*data.split('train'), params, os.cpu_count() or 1)
+    # The backend encodes dense rows where absent one-hot columns are 0, the splits are made to route 0 like missing
+    booster = densify_one_hot_splits(booster, range(len(transformer.numeric), transformer.n_features))
+    X_test, y_test = data.split('test')
+    predictions = booster.inplace_predict(X_test)
+    print(f'Test RMSE: {np.sqrt(np.mean((predictions - y_test) ** 2)):.2f}')
+    for path in export_native(booster, transformer, model_dir):
+        print(f'Wrote {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search XGBoost hyperparameters with successive halving')
+    parser.add_argument('dataset', nargs='?', default='../data/cleaned_cars')
+    parser.add_argument('--trials', type=int, default=81, help='random configs drawn from the grid')
+    parser.add_argument('--rungs', type=int, default=3)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--checkpoint', default='hyperparameter_search.jsonl')
+    parser.add_argument('--output', default=BEST_HYPERPARAMETERS_PATH)
+    parser.add_argument('--model-dir', default=None, help='also fit the winner and export it there')
+    args = parser.parse_args()
+
+    report = StageReport()
+    data = load_training_data(args.dataset, report=report)
+    print(f'{data.X.shape[0]} listings, {data.X.shape[1]} features, {data.X.nnz} stored values')
+    print(report)
+    with tempfile.TemporaryDirectory() as feature_dir:
+        data.save(feature_dir)
+        start, stop = data.bounds['train']
+        best, rmse = search(feature_dir, sample_configs(args.trials), stop - start, args.checkpoint, args.workers,
+                            args.rungs, args.eta)
+    print(f'Best validation RMSE {rmse:.2f} with {best}')
+    write_best(best, args.output)
+    if args.model_dir:
+        export(data, best, args.model_dir)
+
+
+if __name__ == '__main__':
+    main()
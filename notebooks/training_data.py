@@ -0,0 +1,219 @@
+# Builds the training features as a CSR matrix straight from the Parquet dataset, without the dense copies of the
+# notebook's get_dummies / np.array path, and reports the peak RSS of each stage:
+#   python training_data.py ../data/cleaned_cars
+#   python training_data.py ../data/cleaned_cars --baseline   # the notebook's dense path, for comparison
+#   python training_data.py ../data/cleaned_cars --snapshot ../backend/benchmarks/snapshot.csv
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.model_selection import train_test_split
+from data_store import CATEGORICAL_COLUMNS, COLUMNS, iter_batches, read_dataset
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+from app.features import DERIVED_COLUMNS, FeatureTransformer, derive_frame  # noqa: E402
+
+SPLITS = ['train', 'val', 'test']
+TARGET = 'price'
+
+
+def peak_rss():
+    # VmHWM is the peak resident set size since the last reset_peak_rss, ru_maxrss the peak of the whole process
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class StageReport:
+    """Wall time and peak RSS of each stage. Outside Linux the peak is not reset and is the process peak so far."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        reset_peak_rss()
+        started = time.perf_counter()
+        yield
+        self.stages.append((name, time.perf_counter() - started, peak_rss()))
+
+    def __str__(self):
+        lines = [f'{"stage":>24} {"seconds":>9} {"peak RSS MB":>12}']
+        lines += [f'{name:>24} {seconds:>9.2f} {rss / 1e6:>12.0f}' for name, seconds, rss in self.stages]
+        return '\n'.join(lines)
+
+
+def csr_rows(X, start, stop):
+    # Rows start:stop of a CSR matrix sharing its data and indices. Slicing, or passing the views to the
+    # constructor, copies them, so they are set on an empty matrix instead.
+    begin, end = X.indptr[start], X.indptr[stop]
+    view = sp.csr_matrix((stop - start, X.shape[1]), dtype=X.dtype)
+    view.data, view.indices = X.data[begin:end], X.indices[begin:end]
+    view.indptr = (X.indptr[start:stop + 1] - begin).astype(X.indices.dtype)
+    return view
+
+
+class TrainingData:
+    """
+    Features and prices with the rows ordered train, validation then test, so that every split is a contiguous
+    range and `split` returns views instead of copies.
+    """
+
+    def __init__(self, transformer, X, y, bounds):
+        self.transformer = transformer
+        self.X = X
+        self.y = y
+        self.bounds = bounds
+
+    def split(self, name, n_rows=None):
+        start, stop = self.bounds[name]
+        if n_rows is not None:
+            stop = min(stop, start + n_rows)
+        return csr_rows(self.X, start, stop), self.y[start:stop]
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ['data', 'indices', 'indptr']:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self.X, name))
+        np.save(os.path.join(directory, 'y.npy'), self.y)
+        np.save(os.path.join(directory, 'bounds.npy'), np.array([self.bounds[name] for name in SPLITS]))
+        with open(os.path.join(directory, 'shape.txt'), 'w') as f:
+            f.write(f'{self.X.shape[0]} {self.X.shape[1]}')
+
+    @classmethod
+    def load(cls, directory, transformer=None, mmap_mode='r'):
+        # Memory mapped by default, so processes loading the same directory share one copy through the page cache
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+                  for name in ['data', 'indices', 'indptr', 'y']}
+        with open(os.path.join(directory, 'shape.txt')) as f:
+            shape = tuple(int(size) for size in f.read().split())
+        X = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False)
+        bounds = np.load(os.path.join(directory, 'bounds.npy'))
+        return cls(transformer, X, arrays['y'], {name: tuple(int(i) for i in bounds[k]) for k, name in
+                                                  enumerate(SPLITS)})
+
+
+def fit_transformer(root, batch_size=100_000, min_count=1, transformer_class=FeatureTransformer):
+    # Same vocabularies as FeatureTransformer.fit(read_dataset(root)), collected batch by batch from the counts of
+    # the distinct values only. Values seen fewer than `min_count` times are left out.
+    counts = {column: Counter() for column in CATEGORICAL_COLUMNS}
+    for batch in iter_batches(root, columns=CATEGORICAL_COLUMNS, batch_size=batch_size):
+        for column in CATEGORICAL_COLUMNS:
+            derived = {column: DERIVED_COLUMNS[column]} if column in DERIVED_COLUMNS else {}
+            distinct = batch.groupby([column, *derived.values()], observed=True).size().rename('count').reset_index()
+            distinct = derive_frame(distinct, derived)
+            counts[column].update(distinct.groupby(distinct[column].astype(str))['count'].sum().to_dict())
+    numeric = [c for c in COLUMNS if c not in CATEGORICAL_COLUMNS and c not in ('url', TARGET)]
+    return transformer_class(numeric, {column: sorted(value for value, count in counts[column].items()
+                                                      if count >= min_count) for column in CATEGORICAL_COLUMNS})
+
+
+def encode(root, transformer, batch_size=100_000):
+    # Each batch is encoded to CSR by the serving code path and only its stored values are kept
+    data, indices, indptr, prices = [], [], [np.zeros(1, dtype=np.int64)], []
+    nnz = 0
+    for batch in iter_batches(root, columns=[c for c in COLUMNS if c != 'url'], batch_size=batch_size):
+        chunk = transformer.encode_frame(batch.drop(columns=TARGET), sparse=True)
+        data.append(chunk.data)
+        indices.append(chunk.indices)
+        indptr.append(chunk.indptr[1:].astype(np.int64) + nnz)
+        nnz += chunk.nnz
+        prices.append(batch[TARGET].to_numpy(dtype=np.float32))
+    y = np.concatenate(prices) if prices else np.empty(0, dtype=np.float32)
+    X = sp.csr_matrix((np.concatenate(data) if data else np.empty(0, dtype=np.float32),
+                       np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+                       np.concatenate(indptr)), shape=(len(y), transformer.n_features))
+    return X, y
+
+
+def split_order(n):
+    # Same shuffle and train/validation/test rows as the notebook
+    order = pd.Series(np.arange(n)).sample(frac=1, random_state=0).to_numpy()
+    train, test = train_test_split(order, test_size=0.4, random_state=42)
+    test, val = train_test_split(test, test_size=0.5, random_state=42)
+    return {'train': train, 'val': val, 'test': test}
+
+
+def load_training_data(root, batch_size=100_000, report=None):
+    report = report or StageReport()
+    with report.stage('fit transformer'):
+        transformer = fit_transformer(root, batch_size)
+    with report.stage('encode'):
+        X, y = encode(root, transformer, batch_size)
+    with report.stage('split'):
+        splits = split_order(len(y))
+        order = np.concatenate([splits[name] for name in SPLITS])
+        X, y = X[order], y[order]
+        stops = np.cumsum([len(splits[name]) for name in SPLITS])
+        bounds = {name: (int(stop - len(splits[name])), int(stop)) for name, stop in zip(SPLITS, stops)}
+    return TrainingData(transformer, X, y, bounds)
+
+
+def write_snapshot(root, path, n_rows=20_000):
+    # Raw listings of the test split, never trained on, as the fixed input of backend/benchmarks/models.py
+    df = read_dataset(root, categorical=False)
+    df.iloc[split_order(len(df))['test'][:n_rows]].to_csv(path, index=False)
+
+
+def load_dense_baseline(root, report):
+    # The notebook's steps, kept only to measure what the sparse loader saves
+    with report.stage('read dataset'):
+        df = read_dataset(root).drop(columns='url')
+    with report.stage('get_dummies'):
+        df = FeatureTransformer.fit(df).derive_frame(df).sample(frac=1, random_state=0)
+        df = pd.get_dummies(df, columns=CATEGORICAL_COLUMNS)
+    with report.stage('split'):
+        X_train, X_test, y_train, y_test = train_test_split(df.drop(columns=TARGET), df[TARGET], test_size=0.4,
+                                                            random_state=42)
+        X_test, X_val, y_test, y_val = train_test_split(X_test, y_test, test_size=0.5, random_state=42)
+    with report.stage('np.array'):
+        arrays = [np.array(X) for X in (X_train, X_val, X_test)]
+    return arrays
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load the training features and report the memory of each stage')
+    parser.add_argument('dataset', nargs='?', default='../data/cleaned_cars')
+    parser.add_argument('--batch-size', type=int, default=100_000)
+    parser.add_argument('--baseline', action='store_true', help="measure the notebook's dense path instead")
+    parser.add_argument('--output', default=None, help='save the matrices to this directory')
+    parser.add_argument('--snapshot', default=None, help='write a CSV of test listings for the model benchmarks')
+    parser.add_argument('--snapshot-rows', type=int, default=20_000)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        write_snapshot(args.dataset, args.snapshot, args.snapshot_rows)
+        return
+    report = StageReport()
+    if args.baseline:
+        load_dense_baseline(args.dataset, report)
+    else:
+        data = load_training_data(args.dataset, args.batch_size, report)
+        print(f'{data.X.shape[0]} listings, {data.X.shape[1]} features, {data.X.nnz} stored values '
+              f'({(data.X.data.nbytes + data.X.indices.nbytes + data.X.indptr.nbytes) / 1e6:.0f} MB)')
+        if args.output:
+            data.save(args.output)
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Compact serving variants of the price model, each exported to its own directory and served by the backend with
+# MODEL_VARIANT=<name>:
+#   python variants.py ../data/cleaned_cars --output-dir ../backend/app/variants
+# - shallow: the tuned hyperparameters with shallower trees, cut where the validation RMSE stops improving
+# - categorical: XGBoost's native categorical splits on one feature per column instead of thousands of one-hot ones
+# Compare them with the default model on a snapshot with backend/benchmarks/models.py.
+import argparse
+import ast
+import os
+import sys
+import numpy as np
+import xgboost as xgb
+from data_store import COLUMNS, iter_batches
+from train import BEST_HYPERPARAMETERS_PATH, booster_params
+from training_data import fit_transformer, load_training_data, split_order
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+from app.export_model import export_native  # noqa: E402
+from app.features import CategoricalTransformer  # noqa: E402
+from app.inference import densify_one_hot_splits  # noqa: E402
+
+VARIANTS = ['shallow', 'categorical']
+
+
+def read_params(path=BEST_HYPERPARAMETERS_PATH):
+    with open(path) as f:
+        return ast.literal_eval(f.read())
+
+
+def boost(params, dtrain, dval, max_rounds, nthread):
+    # Keeps the trees up to the best validation RMSE
+    booster = xgb.train(booster_params(params, nthread), dtrain, num_boost_round=max_rounds,
+                        evals=[(dval, 'val')], early_stopping_rounds=20, verbose_eval=False)
+    return booster[:booster.best_iteration + 1]
+
+
+def shallow_variant(root, params, max_depth, max_rounds, nthread):
+    data = load_training_data(root)
+    transformer = data.transformer
+    dtrain = xgb.DMatrix(*data.split('train'), nthread=nthread)
+    dval = xgb.DMatrix(*data.split('val'), nthread=nthread)
+    booster = boost(dict(params, max_depth=min(max_depth, params['max_depth'])), dtrain, dval, max_rounds, nthread)
+    # Trained on CSR, the one-hot splits are made to route the backend's dense zeros like missing values
+    return densify_one_hot_splits(booster, range(len(transformer.numeric), transformer.n_features)), transformer
+
+
+def categorical_variant(root, params, max_rounds, nthread, min_count, batch_size=100_000):
+    # A categorical split stores every category it sends one way, rare values are encoded as missing instead so
+    # that the model stays small
+    transformer = fit_transformer(root, batch_size, min_count, CategoricalTransformer)
+    chunks, prices = [], []
+    for batch in iter_batches(root, columns=[c for c in COLUMNS if c != 'url'], batch_size=batch_size):
+        chunks.append(transformer.encode_frame(batch.drop(columns='price')))
+        prices.append(batch['price'].to_numpy(dtype=np.float32))
+    X, y = np.concatenate(chunks), np.concatenate(prices)
+    splits = split_order(len(y))
+    feature_types = ['q'] * len(transformer.numeric) + ['c'] * len(transformer.categorical)
+    dtrain, dval = [xgb.DMatrix(X[splits[name]], label=y[splits[name]], feature_names=transformer.feature_names,
+                                feature_types=feature_types, enable_categorical=True, nthread=nthread)
+                    for name in ['train', 'val']]
+    return boost(params, dtrain, dval, max_rounds, nthread), transformer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train and export compact variants of the price model')
+    parser.add_argument('dataset', nargs='?', default='../data/cleaned_cars')
+    parser.add_argument('--output-dir', default='../backend/app/variants')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=VARIANTS)
+    parser.add_argument('--params', default=BEST_HYPERPARAMETERS_PATH)
+    parser.add_argument('--max-depth', type=int, default=4, help='tree depth of the shallow variant')
+    parser.add_argument('--max-rounds', type=int, default=None,
+                        help='most trees per variant, the tuned count by default')
+    parser.add_argument('--min-count', type=int, default=20,
+                        help='listings a value needs to get its own category in the categorical variant')
+    parser.add_argument('--nthread', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    params = read_params(args.params)
+    max_rounds = args.max_rounds or params['n_estimators']
+    for name in args.variants:
+        if name == 'shallow':
+            booster, transformer = shallow_variant(args.dataset, params, args.max_depth, max_rounds, args.nthread)
+        else:
+            booster, transformer = categorical_variant(args.dataset, params, max_rounds, args.nthread, args.min_count)
+        paths = export_native(booster, transformer, os.path.join(args.output_dir, name))
+        print(f'{name}: {booster.num_boosted_rounds()} trees, {transformer.n_features} features, wrote {paths[0]}')
+
+
+if __name__ == '__main__':
+    main()